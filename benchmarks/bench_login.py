@@ -0,0 +1,83 @@
+"""
+Measure login latency and database pool occupancy of a running server.
+
+Logins are sent to /token from many concurrent clients while /metrics is
+scraped for db_pool_connections_in_use. Run it against the server before and
+after a change with the same arguments and compare.
+
+Run from the repository root:
+BASE_URL=http://localhost:5001 python -m benchmarks.bench_login
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:5001")
+SCRAPE_INTERVAL = 0.05
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> float:
+    start = time.perf_counter()
+    response = await client.post(
+        "/token", data={"username": username, "password": password}
+    )
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+async def worker(
+    client: httpx.AsyncClient, args: argparse.Namespace, latencies: list[float]
+) -> None:
+    while len(latencies) < args.logins:
+        latencies.append(await login(client, args.username, args.password))
+
+
+async def scrape_pool(client: httpx.AsyncClient, samples: list[float]) -> None:
+    while True:
+        response = await client.get("/metrics/", headers={"Accept": "text/plain"})
+        for line in response.text.splitlines():
+            if line.startswith("db_pool_connections_in_use"):
+                samples.append(float(line.split()[-1]))
+        await asyncio.sleep(SCRAPE_INTERVAL)
+
+
+async def main(args: argparse.Namespace) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(
+        base_url=BASE_URL, limits=limits, timeout=60
+    ) as client:
+        await login(client, args.username, args.password)  # warm up
+        latencies: list[float] = []
+        samples: list[float] = []
+        scraper = asyncio.create_task(scrape_pool(client, samples))
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(worker(client, args, latencies) for _ in range(args.concurrency))
+        )
+        elapsed = time.perf_counter() - start
+        scraper.cancel()
+
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    print(
+        f"logins: {len(latencies)}  {len(latencies) / elapsed:7.1f} logins/s  "
+        f"p50: {quantiles[49]:8.2f} ms  p99: {quantiles[98]:8.2f} ms"
+    )
+    if samples:
+        print(
+            f"pool connections in use  mean: {statistics.fmean(samples):5.2f}  "
+            f"max: {max(samples):3.0f}  samples: {len(samples)}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="weakadmin")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
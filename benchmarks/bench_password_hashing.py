@@ -0,0 +1,82 @@
+"""
+Measure redirect latency while logins hash passwords.
+
+Compares bcrypt running on the event loop, as logins used to, with the password
+hasher thread pool. The redirected url is seeded into the url cache so no
+database is needed.
+
+Run from the repository root: python -m benchmarks.bench_password_hashing
+"""
+
+import argparse
+import asyncio
+import statistics
+
+from benchmarks.utils import asgi_get
+from lemonapi.main import app
+from lemonapi.utils import auth
+from lemonapi.utils.crud import ResolvedURL, url_cache
+
+URL_KEY = "BENCH"
+PASSWORD = "weakadmin"
+INTERVAL = 0.005
+LOGIN_INTERVAL = 0.1
+
+
+async def inline_login(hashed: str, delay: float) -> None:
+    await asyncio.sleep(delay)
+    auth.pwd_context.verify(PASSWORD, hashed)
+
+
+async def offloaded_login(hashed: str, delay: float) -> None:
+    await asyncio.sleep(delay)
+    await auth.verify_password(PASSWORD, hashed)
+
+
+async def measure(login, hashed: str, logins: int) -> list[float]:
+    """
+    Redirect latencies in milliseconds while logins run.
+
+    Redirects are scheduled every INTERVAL seconds and latency is counted from
+    the scheduled time, so time spent waiting for a blocked event loop counts.
+    """
+    loop = asyncio.get_running_loop()
+    # one login arrives every LOGIN_INTERVAL seconds
+    tasks = [
+        asyncio.create_task(login(hashed, number * LOGIN_INTERVAL))
+        for number in range(logins)
+    ]
+    latencies = []
+    scheduled = loop.time()
+    while not all(task.done() for task in tasks):
+        scheduled += INTERVAL
+        await asyncio.sleep(max(0, scheduled - loop.time()))
+        await asgi_get(app, f"/{URL_KEY}")
+        latencies.append((loop.time() - scheduled) * 1000)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def main(logins: int) -> None:
+    url_cache.set(URL_KEY, ResolvedURL("https://example.com/", True), ttl=3600)
+    hashed = auth.pwd_context.hash(PASSWORD)
+    await asgi_get(app, f"/{URL_KEY}")  # warm up
+
+    for name, login in (
+        ("on event loop", inline_login),
+        ("offloaded", offloaded_login),
+    ):
+        latencies = await measure(login, hashed, logins)
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        print(
+            f"{name:<14} redirects: {len(latencies):>4}  "
+            f"p50: {quantiles[49]:8.2f} ms  p99: {quantiles[98]:8.2f} ms  "
+            f"max: {max(latencies):8.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins))
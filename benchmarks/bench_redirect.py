@@ -0,0 +1,64 @@
+"""
+Compare the raw ASGI redirect route against the FastAPI route it replaced.
+
+The url is seeded into the in-process url cache so no database is needed,
+the numbers show framework overhead per redirect only.
+
+Run from the repository root: python -m benchmarks.bench_redirect
+"""
+
+import argparse
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.responses import RedirectResponse
+
+from benchmarks.utils import asgi_get, requests_per_second
+from lemonapi.endpoints import shortener
+from lemonapi.main import app
+from lemonapi.utils.crud import CrudServiceDep, ResolvedURL, url_cache
+
+URL_KEY = "BENCH"
+
+
+async def dependency_redirect(
+    request: Request, url_key: str, crud_service: CrudServiceDep
+):
+    """The redirect handler as it was before the raw route."""
+    if url_key == "docs":
+        return RedirectResponse("/docs/")
+    resolved = await crud_service.resolve_url(url_key=url_key)
+    if resolved:
+        crud_service.update_db_clicks(url_key=url_key)
+        return RedirectResponse(resolved.target_url)
+    shortener.raise_not_found(request)
+
+
+def build_apps() -> dict[str, FastAPI]:
+    # the previous route, dependency injected handler behind the router
+    dependency_route = FastAPI()
+    dependency_route.add_api_route("/{url_key}", dependency_redirect)
+
+    raw_route = FastAPI()
+    raw_route.router.routes.insert(0, shortener.redirect_route)
+    return {
+        "dependency route": dependency_route,
+        "raw asgi route": raw_route,
+        "full app (raw asgi route + middleware)": app,
+    }
+
+
+async def main(requests: int) -> None:
+    # long ttl so the entry outlives the benchmark
+    url_cache.set(URL_KEY, ResolvedURL("https://example.com/", True), ttl=3600)
+    for name, bench_app in build_apps().items():
+        assert await asgi_get(bench_app, f"/{URL_KEY}") == 307
+        rps = await requests_per_second(bench_app, f"/{URL_KEY}", requests)
+        print(f"{name:<42} {rps:>10,.0f} requests/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
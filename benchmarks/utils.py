@@ -0,0 +1,44 @@
+"""Helpers shared by the benchmarks."""
+
+import time
+
+from starlette.types import ASGIApp
+
+
+async def asgi_get(app: ASGIApp, path: str) -> int:
+    """Send a GET request straight to an ASGI app and return the status code."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"benchmark")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+    }
+    status = 0
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def requests_per_second(app: ASGIApp, path: str, requests: int) -> float:
+    """Run requests sequentially against the app and return requests/sec."""
+    await asgi_get(app, path)  # warm up, builds middleware stack
+    start = time.perf_counter()
+    for _ in range(requests):
+        await asgi_get(app, path)
+    return requests / (time.perf_counter() - start)
@@ -10,13 +10,18 @@ from lemonapi.utils import dependencies
 
 from lemonapi.utils.constants import Server
 from lemonapi.utils.crud import CrudServiceDep
+from lemonapi.utils.scopes import RequiredScopes
 
 
 from lemonapi.utils.auth import (
     User,
     get_current_active_user,
+    get_current_session_user,
     RefreshToken,
+    RevokeToken,
     AccessToken,
+    NewApiKey,
+    ApiKeyCreated,
 )
 
 router = APIRouter()
@@ -55,25 +60,25 @@ async def login_for_refresh_token(
     HTTPException
         When incorrect username or password is provided.
     """
-    async with pool.acquire() as con:
-        user = await auth.authenticate_user(
-            form_data.username, form_data.password, request=request, pool=con
-        )
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Incorrect username or password",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        user_id = await con.fetchrow(
-            "SELECT user_id FROM users WHERE username = $1", user.username
-        )
-        refresh_token, _ = await auth.reset_refresh_token(
-            con=con,
-            user_id=user_id[0],
+    # every query runs on its own pooled connection, none is held while the
+    # password is verified
+    user = await auth.authenticate_user(
+        form_data.username, form_data.password, request=request, pool=pool
+    )
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
         )
+    # every login starts its own session
+    refresh_token, _ = await auth.reset_refresh_token(
+        con=pool,
+        user_id=user.user_id,
+        device=request.headers.get("user-agent", "")[:256] or None,
+    )
     logger.info(
-        f"Successful login: User ID - {user_id}, Client IP - {request.client.host}"
+        f"Successful login: User ID - {user.user_id}, Client IP - {request.client.host}"
     )
     redirect = RedirectResponse(url="/showtoken", status_code=303)
     redirect.set_cookie(
@@ -121,6 +126,17 @@ async def authenticate(
     }
 
 
+@router.post("/token/revoke")
+async def revoke_token(body: RevokeToken, pool: dependencies.PoolDep):
+    """
+    Revoke an access or refresh token before it expires.
+
+    Other workers reject the token within a few seconds.
+    """
+    await auth.revoke_token(pool, body.token)
+    return {"detail": "Token revoked"}
+
+
 @router.post("/users/add/")
 async def add_user(
     request: Request, crud_service: CrudServiceDep, user: auth.NewUser = Depends()
@@ -134,7 +150,7 @@ async def add_user(
 @router.patch("/users/update/password")
 async def update_password(
     request: Request,
-    user: Annotated[User, Depends(get_current_active_user)],
+    user: Annotated[User, Depends(get_current_session_user)],
     new_password: str,
     crud_service: CrudServiceDep,
 ):
@@ -143,6 +159,45 @@ async def update_password(
     return {"detail": row, "dt": message}
 
 
+@router.post(
+    "/users/{user_id}/disable",
+    dependencies=[Depends(RequiredScopes(["users:disable"]))],
+)
+async def disable_user(user_id: str, crud_service: CrudServiceDep):
+    """
+    Disable a user, their sessions and api keys stop working right away.
+
+    Requires the users:disable scope, admins have it.
+    """
+    row = await crud_service.disable_user(user_id)
+    return {"detail": f"User '{row['username']}' disabled"}
+
+
+@router.post("/users/api-keys", response_model=ApiKeyCreated)
+async def create_api_key(
+    body: NewApiKey,
+    user: Annotated[User, Depends(get_current_session_user)],
+    crud_service: CrudServiceDep,
+):
+    """
+    Create an api key for machine clients, sent in the X-API-Key header.
+
+    The key is only shown in this response.
+    """
+    return await crud_service.create_api_key(user, body)
+
+
+@router.delete("/users/api-keys/{key_id}")
+async def revoke_api_key(
+    key_id: str,
+    user: Annotated[User, Depends(get_current_session_user)],
+    crud_service: CrudServiceDep,
+):
+    """Revoke an api key, other workers may accept it for up to a minute."""
+    await crud_service.revoke_api_key(user, key_id)
+    return {"detail": "Api key revoked"}
+
+
 @router.get("/users/me", response_model=User)
 async def read_users_me(
     current_user: Annotated[User, Depends(get_current_active_user)],
@@ -1,49 +1,143 @@
+import json
 import validators
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import RedirectResponse
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from aioprometheus import REGISTRY, Counter
+from starlette.convertors import Convertor, register_url_convertor
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.routing import Route
+from starlette.types import Receive, Scope, Send
+from urllib.parse import quote, urlsplit
 
 from typing import Annotated
-from loguru import logger
 
 from lemonapi.utils import schemas
+from lemonapi.utils.analytics import click_log
+from lemonapi.utils.cache import TTLCache
 from lemonapi.utils.constants import Server
-from lemonapi.utils.crud import CrudServiceDep
+from lemonapi.utils.crud import CrudService, CrudServiceDep
+from lemonapi.utils.database import Connection
+from lemonapi.utils.keys import KEY_PATTERN, KEY_REGEX
 
 router = APIRouter()
 
+# Idempotency-Key -> (target url, created url) of recent url creations
+idempotency_cache = TTLCache(
+    "idempotency", maxsize=Server.IDEMPOTENCY_CACHE_SIZE, ttl=Server.IDEMPOTENCY_TTL
+)
+
+rejected_probes = Counter(
+    "url_key_probes_rejected",
+    "Requests to single segment paths that can not be url keys.",
+    registry=REGISTRY,
+)
+
 
 templates = Jinja2Templates(directory="lemonapi/templates")
 
 
+def is_valid_url(url: str) -> bool:
+    """Check url like `validators.url`, which also accepts ports above 65535."""
+    if not validators.url(url):
+        return False
+    try:
+        urlsplit(url).port
+    except ValueError:
+        return False
+    return True
+
+
 def raise_bad_request(message):
     raise HTTPException(status_code=400, detail=message)
 
 
+def raise_too_many_urls():
+    raise HTTPException(
+        status_code=413,
+        detail=f"At most {Server.BULK_URL_LIMIT} URLs can be created at once",
+    )
+
+
 def raise_not_found(request):
     message = f"URL '{request.url}' does not exist"
     raise HTTPException(status_code=404, detail=message)
 
 
+class ShortKeyConvertor(Convertor):
+    """Path convertor matching only keys that `create_random_key` can generate."""
+
+    regex = KEY_REGEX
+
+    def convert(self, value: str) -> str:
+        return value
+
+    def to_string(self, value: str) -> str:
+        return value
+
+
+register_url_convertor("shortkey", ShortKeyConvertor())
+
+
+class ShortLinkRedirect:
+    """Plain ASGI endpoint for redirecting shortened urls.
+
+    This is the most requested endpoint, so it skips FastAPI dependency
+    injection, request parsing and response models, and writes the redirect
+    directly. Unknown keys raise 404 which is rendered by the app's exception
+    handler like any other missing page.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        url_key = scope["path_params"]["url_key"]
+        crud_service = CrudService(Connection.DB_POOL)
+        resolved = await crud_service.resolve_url(url_key)
+        if resolved is None:
+            raise StarletteHTTPException(status_code=404)
+
+        if scope["method"] == "GET":
+            crud_service.update_db_clicks(url_key)
+            click_log.record(url_key, scope)
+        # same quoting as starlette's RedirectResponse
+        location = quote(resolved.target_url, safe=":/%#?=@[]!$&'()*+,;")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 307,
+                "headers": [
+                    (b"location", location.encode("latin-1")),
+                    (b"content-length", b"0"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": b""})
+
+
+# Mounted ahead of every other route by the app, see main.py.
+redirect_route = Route(
+    "/{url_key:shortkey}",
+    ShortLinkRedirect(),
+    methods=["GET"],
+    name="redirect",
+    include_in_schema=False,
+)
+
+
 @router.get("/{url_key}", include_in_schema=False)
-async def forward_to_target_url(
-    request: Request, url_key: str, crud_service: CrudServiceDep
-):
+async def forward_to_target_url(request: Request, url_key: str):
+    """Catch all for single segment paths that did not match any other route.
+
+    Valid url keys are redirected by `redirect_route` before routing gets here,
+    so whatever reaches this route can not exist and is rejected without a
+    database query.
+    """
     if url_key == "docs":
         return RedirectResponse("/docs/")
-    row = await crud_service.get_db_url_by_key(url_key=url_key)
-
-    try:
-        url_object = schemas.URL(**dict(row))
-    except Exception as e:
-        logger.trace(e)
-    if row:
-        row = await crud_service.update_db_clicks(db_url=url_object)
-
-        return RedirectResponse(row["target_url"])
-    else:
-        raise_not_found(request)
+    rejected_probes.inc({})
+    raise_not_found(request)
 
 
 @router.delete("/admin/{secret_key}")
@@ -61,14 +155,147 @@ async def delete_url(request: Request, secret_key: str, crud_service: CrudServic
 
 
 @router.post("/url/")
-async def create_url(url: schemas.URLBase, crud_service: CrudServiceDep):
-    if not validators.url(url.target_url):
+async def create_url(
+    url: schemas.URLCreate,
+    crud_service: CrudServiceDep,
+    dedup: bool = False,
+    idempotency_key: Annotated[str | None, Header()] = None,
+):
+    """Create a shortened url.
+
+    - **expires_at**: optional time after which the url stops redirecting and is
+    deleted, UTC unless a timezone is given.
+    - **dedup**: return an existing active url with the same target and expiry
+    time if there is one, its secret key is not returned.
+    - **Idempotency-Key**: unique value, e.g. an UUID, retries with the same value
+    return the response of the first request instead of creating another url.
+    """
+    if not is_valid_url(url.target_url):
         raise HTTPException(status_code=400, detail="Your provided URL is not invalid")
-    db_url = await crud_service.create_db_url(url=url)
+    if url.expires_at is not None and url.expires_at <= datetime.now(timezone.utc):
+        raise_bad_request("Expiry time must be in the future")
+    if idempotency_key is None:
+        return await crud_service.create_db_url(url=url, dedup=dedup)
+
+    async def create():
+        db_url = await crud_service.create_db_url(url=url, dedup=dedup)
+        return url.target_url, dict(db_url)
 
+    target_url, db_url = await idempotency_cache.get_or_load(idempotency_key, create)
+    if target_url != url.target_url:
+        raise HTTPException(
+            status_code=422, detail="Idempotency-Key was already used for another URL"
+        )
     return db_url
 
 
+def isoformat(value: datetime) -> str:
+    return value.isoformat()
+
+
+def parse_target_url(entry: str | dict) -> str:
+    """Bulk entries may be plain target urls or objects like URLBase."""
+    if isinstance(entry, dict):
+        entry = entry.get("target_url")
+    if not isinstance(entry, str):
+        raise_bad_request("Entries must be URLs or objects with 'target_url'")
+    return entry
+
+
+async def read_target_urls(request: Request) -> list[str]:
+    """Read target urls from a JSON array or from a NDJSON stream."""
+    content_type = request.headers.get("content-type", "")
+    target_urls = []
+    try:
+        if content_type.startswith("application/x-ndjson"):
+            buffer = b""
+            async for chunk in request.stream():
+                *lines, buffer = (buffer + chunk).split(b"\n")
+                target_urls.extend(
+                    parse_target_url(json.loads(line)) for line in lines if line.strip()
+                )
+                if len(target_urls) > Server.BULK_URL_LIMIT:
+                    # stop reading, the rest of the body is never parsed
+                    raise_too_many_urls()
+            if buffer.strip():
+                target_urls.append(parse_target_url(json.loads(buffer)))
+        else:
+            body = await request.json()
+            if not isinstance(body, list):
+                raise_bad_request("Expected a JSON array of URLs")
+            target_urls = [parse_target_url(entry) for entry in body]
+    except json.JSONDecodeError:
+        raise_bad_request("Request body is not valid JSON")
+
+    if len(target_urls) > Server.BULK_URL_LIMIT:
+        raise_too_many_urls()
+    return target_urls
+
+
+@router.post("/url/bulk")
+async def create_urls_in_bulk(request: Request, crud_service: CrudServiceDep):
+    """Create urls from a JSON array or a NDJSON stream of target urls.
+
+    All urls are validated before any is created. Created urls are streamed
+    back as NDJSON, one object with url_key, target_url and secret_key per line.
+    """
+    target_urls = await read_target_urls(request)
+    invalid = [
+        position
+        for position, target_url in enumerate(target_urls)
+        if not is_valid_url(target_url)
+    ]
+    if invalid:
+        raise_bad_request(f"Invalid URLs at positions: {invalid[:100]}")
+
+    async def created_urls():
+        async for rows in crud_service.create_db_urls(target_urls):
+            yield "".join(json.dumps(dict(row)) + "\n" for row in rows)
+
+    return StreamingResponse(created_urls(), media_type="application/x-ndjson")
+
+
+@router.post("/url/resolve")
+async def resolve_urls(
+    crud_service: CrudServiceDep,
+    urls: Annotated[
+        list[str], Body(examples=[["UEWIS", "http://localhost:5001/UEWIS"]])
+    ],
+):
+    """Look up many url keys or shortened urls at once.
+
+    Streams NDJSON, one object per distinct key with found, target_url,
+    is_active, clicks, created_at and expires_at. Keys that do not exist only
+    have url_key and found.
+    """
+    if len(urls) > Server.RESOLVE_URL_LIMIT:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {Server.RESOLVE_URL_LIMIT} URLs can be resolved at once",
+        )
+    url_keys = list(dict.fromkeys(url.rstrip("/").rsplit("/", 1)[-1] for url in urls))
+    valid_keys = [url_key for url_key in url_keys if KEY_PATTERN.fullmatch(url_key)]
+
+    found = await crud_service.get_db_urls_by_keys(valid_keys)
+
+    async def resolved_urls():
+        missing = set(url_keys)
+        chunk_size = Server.RESOLVE_URL_CHUNK_SIZE
+        for start in range(0, len(found), chunk_size):
+            rows = found[start : start + chunk_size]
+            lines = []
+            for row in rows:
+                missing.discard(row["url_key"])
+                lines.append(json.dumps({"found": True, **row}, default=isoformat))
+            yield "\n".join(lines) + "\n"
+        # keep input order for keys that were not found
+        for url_key in url_keys:
+            if url_key in missing:
+                yield json.dumps({"url_key": url_key, "found": False}) + "\n"
+
+    return StreamingResponse(resolved_urls(), media_type="application/x-ndjson")
+
+
 @router.get("/url/inspect")
 async def inspect_url(
     crud_service: CrudServiceDep, url: Annotated[schemas.URLBase, Depends()]
@@ -80,17 +307,39 @@ async def inspect_url(
         raise HTTPException(status_code=400, detail="Your provided URL is not invalid")
 
     url_key = url.target_url.split("/")[-1]
-    # url key length does not match the defined length, raise HTTPException
-    if len(url_key) != Server.KEY_LENGTH:
+    # url key does not look like a generated key, raise HTTPException
+    if not KEY_PATTERN.fullmatch(url_key):
         raise HTTPException(status_code=400, detail="Your provided URL is not invalid")
 
     url_info = await crud_service.get_db_url_by_key(url_key=url_key)
 
     target = url_info["target_url"]  # target where 'url.target_url' redirects to
     created_at = url_info["created_at"]
+    clicks = url_info["clicks"]
 
     message = (
-        f"URL '{url.target_url}' redirects to '{target}'. Created at: {created_at}"
+        f"URL '{url.target_url}' redirects to '{target}'. Created at: {created_at}. "
+        f"Clicks: {clicks}"
     )
 
     return {"detail": message}
+
+
+@router.get("/url/{url_key}/stats")
+async def url_stats(
+    request: Request,
+    url_key: str,
+    crud_service: CrudServiceDep,
+    minutes: Annotated[int, Query(ge=1, le=24 * 60)] = 60,
+    hours: Annotated[int, Query(ge=1, le=24 * 31)] = 48,
+    days: Annotated[int, Query(ge=1, le=3660)] = 30,
+):
+    """Total clicks of a shortened url and clicks per minute, hour and day.
+
+    Buckets without clicks are left out. Counts lag behind real time by up to
+    a minute as they are aggregated in the background.
+    """
+    if await crud_service.resolve_url(url_key=url_key) is None:
+        raise_not_found(request)
+    stats = await crud_service.get_url_stats(url_key, minutes, hours, days)
+    return {"url_key": url_key, **stats}
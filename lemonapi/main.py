@@ -5,7 +5,7 @@ import pathlib
 import typing
 
 from loguru import logger
-from aioprometheus import MetricsMiddleware, REGISTRY, Counter, render
+from aioprometheus import MetricsMiddleware, REGISTRY, Counter, Gauge, render
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request, Depends, Header
@@ -15,14 +15,21 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from lemonapi.endpoints import security, shortener, lemons  # moderation
 from lemonapi.utils.constants import Server
+from lemonapi.utils.analytics import click_log, click_rollup
+from lemonapi.utils.api_keys import api_key_usage
 from lemonapi.utils.auth import get_current_active_user
+from lemonapi.utils.bloom import url_key_filter
+from lemonapi.utils.clicks import click_counter
 from lemonapi.utils.database import Connection
+from lemonapi.utils.reaper import revoked_token_reaper, session_reaper, url_reaper
+from lemonapi.utils.signing import key_ring
+from lemonapi.utils.revocation import revoked_tokens, session_salts
 
 # from lemonapi.utils import promthutils
 
 description = """Random API"""
 
-favicon_path = pathlib.Path("./static/images/favicon.ico")
+favicon_path = pathlib.Path("lemonapi/static/images/favicon.ico")
 
 
 @asynccontextmanager
@@ -47,8 +54,28 @@ async def lifespan(app: FastAPI):
     # Create database connection pool
     await Connection.DB_POOL
 
+    # background jobs, stopped in reverse order so buffers are drained
+    # while the pool is still open.
+    background_tasks = [
+        click_counter,
+        click_log,
+        click_rollup,
+        url_key_filter,
+        url_reaper,
+        session_reaper,
+        revoked_tokens,
+        revoked_token_reaper,
+        api_key_usage,
+    ]
+    if Server.STATELESS_AUTH:
+        background_tasks.append(session_salts)
+    for task in background_tasks:
+        task.start(Connection.DB_POOL)
+
     yield
     # closing down, anything after yield will be ran as shutdown event.
+    for task in reversed(background_tasks):
+        await task.stop()
     await Connection.DB_POOL.close()
     logger.info(f"Server shutting down at: {datetime.datetime.now()}")
 
@@ -85,7 +112,6 @@ app.include_router(security.router, tags=["security"])
 app.include_router(
     lemons.router, tags=["lemons"], dependencies=[Depends(get_current_active_user)]
 )
-app.include_router(shortener.router, tags=["shortener"])
 
 
 # Add prometheus middleware
@@ -96,6 +122,11 @@ app.state.event_counter = Counter("events", "Number of events.", registry=REGIST
 app.state.user_created = Counter(
     "users_created", "Number of users created.", registry=REGISTRY
 )
+app.state.pool_in_use = Gauge(
+    "db_pool_connections_in_use",
+    "Database connections checked out of the pool, updated when scraped.",
+    registry=REGISTRY,
+)
 
 # Example query for prometheus to get number of users created in the past week.
 # Counter value as is might not be useful for statistics, but using something like
@@ -128,7 +159,9 @@ async def my_exception_handler(request: Request, exception: StarletteHTTPExcepti
 
     else:
         return Response(
-            content=str(exception.detail), status_code=exception.status_code
+            content=str(exception.detail),
+            status_code=exception.status_code,
+            headers=getattr(exception, "headers", None),
         )
 
 
@@ -139,6 +172,16 @@ async def get_docs(request: Request):
     return Server.TEMPLATES.TemplateResponse(name, {"request": request}, 200)
 
 
+@app.get("/.well-known/jwks.json", include_in_schema=False)
+async def get_jwks():
+    """Public keys that verify tokens, lets other services validate them locally."""
+    return Response(
+        content=key_ring.jwks,
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=300"},
+    )
+
+
 @app.get("/favicon.ico", response_class=FileResponse, include_in_schema=False)
 async def get_favicon(request: Request):
     """This is the favicon.ico file that is returned from the server."""
@@ -168,6 +211,16 @@ async def handle_metrics(
     request: Request,
     accept: typing.List[str] = Header(None),
 ) -> Response:
+    pool = Connection.DB_POOL
+    request.app.state.pool_in_use.set({}, pool.get_size() - pool.get_idle_size())
     content, http_headers = render(REGISTRY, accept)
     logger.trace(f"Metrics requested from IP: {request.client.host}")
     return Response(content=content, media_type=http_headers["Content-Type"])
+
+
+# Included after the routes above, its single segment catch all would
+# otherwise shadow them, e.g. /favicon.ico.
+app.include_router(shortener.router, tags=["shortener"])
+# Short url redirects are matched first, they are by far the most requested
+# paths and the key pattern does not overlap with any other route.
+app.router.routes.insert(0, shortener.redirect_route)
@@ -0,0 +1,205 @@
+"""
+Import users in bulk from a CSV or NDJSON file.
+
+Every row needs username, password, email and full_name (or fullname).
+Passwords are hashed on a process pool while the previous chunk is loaded
+into the database. Users whose username or email already exist are skipped.
+
+Progress is saved to a checkpoint file after every chunk, running the same
+command again after a failure continues from the last loaded chunk.
+
+Run from the repository root:
+python -m lemonapi.tools.import_users users.csv
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import pathlib
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+import asyncpg
+
+from loguru import logger
+from ulid import ULID
+
+from lemonapi.utils.auth import pwd_context
+from lemonapi.utils.database import Connection
+
+
+def read_rows(path: pathlib.Path, file_format: str) -> Iterator[dict]:
+    """Yield rows of the file one at a time."""
+    with path.open(newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_chunks(rows: Iterator[dict], size: int) -> Iterator[list[dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+class Checkpoint:
+    """Number of input rows already loaded, kept in a file next to the input."""
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+
+    def load(self) -> int:
+        try:
+            return int(self.path.read_text())
+        except FileNotFoundError:
+            return 0
+
+    def save(self, rows: int) -> None:
+        # replaced in one step so a crash never leaves a partial file
+        temporary = self.path.with_suffix(".tmp")
+        temporary.write_text(str(rows))
+        os.replace(temporary, self.path)
+
+
+async def hash_chunk(
+    executor: ProcessPoolExecutor, chunk: list[dict], first_row: int = 1
+) -> list[tuple[str, str, str, str, str]]:
+    """Turn rows into user records, rows missing a field are left out.
+
+    Skipped rows are logged by their number, first_row being the number of the
+    first row of the chunk. Rows hold passwords so they are never logged.
+    """
+    loop = asyncio.get_running_loop()
+    valid = []
+    for number, row in enumerate(chunk, start=first_row):
+        full_name = row.get("full_name") or row.get("fullname")
+        if not all((row.get("username"), row.get("password"), row.get("email"))):
+            logger.warning(f"Skipped row {number} without username, password or email")
+        elif not full_name:
+            logger.warning(f"Skipped row {number} without full name: {row['username']}")
+        else:
+            valid.append((row, full_name))
+    hashes = await asyncio.gather(
+        *(
+            loop.run_in_executor(executor, hash_password, row["password"])
+            for row, _ in valid
+        )
+    )
+    return [
+        (str(ULID()), row["username"], hashed, full_name, row["email"])
+        for (row, full_name), hashed in zip(valid, hashes)
+    ]
+
+
+async def load_chunk(con: asyncpg.Connection, records: list[tuple]) -> int:
+    """Insert the records through a staging table, return number inserted."""
+    async with con.transaction():
+        await con.execute(
+            """CREATE TEMPORARY TABLE user_staging (
+                user_id text,
+                username text,
+                hashed_password text,
+                fullname text,
+                email text
+            ) ON COMMIT DROP"""
+        )
+        await con.copy_records_to_table("user_staging", records=records)
+        status = await con.execute(
+            """INSERT INTO users (
+                user_id, username, hashed_password, fullname, email
+            ) SELECT * FROM user_staging
+            ON CONFLICT DO NOTHING"""
+        )
+    return int(status.split()[-1])
+
+
+async def import_users(args: argparse.Namespace) -> None:
+    checkpoint = Checkpoint(args.checkpoint or args.path.with_suffix(".checkpoint"))
+    done = checkpoint.load()
+    if done:
+        logger.info(f"Resuming after {done} rows from {checkpoint.path}.")
+
+    rows = read_rows(args.path, args.format)
+    for _ in range(done):
+        next(rows, None)
+    chunks = read_chunks(rows, args.chunk_size)
+
+    inserted = skipped = 0
+    start = time.perf_counter()
+    con = await asyncpg.connect(args.dsn)
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            chunk = next(chunks, None)
+            hashing = asyncio.ensure_future(
+                hash_chunk(executor, chunk or [], first_row=done + 1)
+            )
+            while chunk is not None:
+                records = await hashing
+                next_chunk = next(chunks, None)
+                # hash the next chunk while this one is loaded
+                hashing = asyncio.ensure_future(
+                    hash_chunk(
+                        executor, next_chunk or [], first_row=done + len(chunk) + 1
+                    )
+                )
+
+                loaded = await load_chunk(con, records) if records else 0
+                inserted += loaded
+                skipped += len(chunk) - loaded
+                done += len(chunk)
+                checkpoint.save(done)
+
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    f"{done} rows read, {inserted} users imported, {skipped} skipped, "
+                    f"{(inserted + skipped) / elapsed:.1f} rows/s"
+                )
+                chunk = next_chunk
+            await hashing
+    finally:
+        await con.close()
+    logger.info(f"Import finished, {inserted} users imported and {skipped} skipped.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", type=pathlib.Path, help="CSV or NDJSON file.")
+    parser.add_argument(
+        "--format",
+        choices=["csv", "ndjson"],
+        help="Format of the file, guessed from its extension by default.",
+    )
+    parser.add_argument("--dsn", default=Connection.DATABASE_URL)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Hashing processes, all cores."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=pathlib.Path,
+        help="Checkpoint file, defaults to the path with a .checkpoint suffix.",
+    )
+    args = parser.parse_args()
+    if args.format is None:
+        args.format = "csv" if args.path.suffix.lower() == ".csv" else "ndjson"
+    asyncio.run(import_users(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import ipaddress
+import time
+
+from collections import deque
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from aioprometheus import REGISTRY, Counter
+from loguru import logger
+from starlette.types import Scope
+
+from .constants import Server
+from .tasks import PeriodicTask
+
+events_written = Counter(
+    "click_events_written", "Click events written to database.", registry=REGISTRY
+)
+events_dropped = Counter(
+    "click_events_dropped",
+    "Click events dropped because the buffer was full or the write failed.",
+    registry=REGISTRY,
+)
+
+rollup_clicks = Counter(
+    "click_events_rolled_up",
+    "Click events aggregated into rollup buckets.",
+    registry=REGISTRY,
+)
+
+ROLLUP_RESOLUTIONS = ["minute", "hour", "day"]
+BOT_MARKERS = ("bot", "crawl", "spider", "curl", "wget", "python", "http")
+MOBILE_MARKERS = ("mobi", "android", "iphone", "ipad")
+
+
+class RawClick(NamedTuple):
+    """Click as recorded by the redirect, parsed only when written."""
+
+    timestamp: float
+    url_key: str
+    referrer: bytes | None
+    user_agent: bytes | None
+    host: str | None
+
+
+def classify_user_agent(user_agent: str | None) -> str:
+    if not user_agent:
+        return "unknown"
+    user_agent = user_agent.lower()
+    if any(marker in user_agent for marker in BOT_MARKERS):
+        return "bot"
+    if any(marker in user_agent for marker in MOBILE_MARKERS):
+        return "mobile"
+    if "mozilla" in user_agent:
+        return "desktop"
+    return "other"
+
+
+def ip_bucket(host: str | None) -> ipaddress.IPv4Network | ipaddress.IPv6Network | None:
+    """Coarse network of the client, /24 for IPv4 and /48 for IPv6."""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    prefix = 24 if address.version == 4 else 48
+    return ipaddress.ip_network(f"{address}/{prefix}", strict=False)
+
+
+class ClickLog(PeriodicTask):
+    """
+    Buffer click events in memory and write them to ``url_clicks`` in batches.
+
+    Recording is a single append to a bounded ring buffer, the redirect never
+    waits for the database. When the writer falls behind the oldest events are
+    overwritten, when a write fails its batch is dropped. Both are counted.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("click-log", interval=Server.CLICK_LOG_FLUSH_INTERVAL)
+        self.events: deque[RawClick] = deque(maxlen=Server.CLICK_LOG_SIZE)
+
+    def record(self, url_key: str, scope: Scope) -> None:
+        referrer = user_agent = None
+        for name, value in scope["headers"]:
+            if name == b"referer":
+                referrer = value
+            elif name == b"user-agent":
+                user_agent = value
+        client = scope.get("client")
+        if len(self.events) == self.events.maxlen:
+            events_dropped.inc({"reason": "full"})
+        self.events.append(
+            RawClick(
+                time.time(),
+                url_key,
+                referrer,
+                user_agent,
+                client[0] if client else None,
+            )
+        )
+
+    async def run_once(self) -> None:
+        if not self.events:
+            return
+        batch, self.events = self.events, deque(maxlen=Server.CLICK_LOG_SIZE)
+        records = [
+            (
+                datetime.fromtimestamp(click.timestamp, timezone.utc),
+                click.url_key,
+                click.referrer.decode("latin-1")[:512] if click.referrer else None,
+                classify_user_agent(
+                    click.user_agent.decode("latin-1") if click.user_agent else None
+                ),
+                ip_bucket(click.host),
+            )
+            for click in batch
+        ]
+        try:
+            async with self.pool.acquire() as con:
+                await con.copy_records_to_table(
+                    "url_clicks",
+                    records=records,
+                    columns=[
+                        "clicked_at",
+                        "url_key",
+                        "referrer",
+                        "agent_class",
+                        "ip_bucket",
+                    ],
+                )
+        except Exception:
+            events_dropped.add({"reason": "error"}, len(records))
+            logger.exception(f"Dropped {len(records)} click events.")
+            return
+        events_written.add({}, len(records))
+        logger.trace(f"Wrote {len(records)} click events.")
+
+    async def on_stop(self) -> None:
+        await self.run_once()
+
+
+class ClickRollup(PeriodicTask):
+    """
+    Aggregate new click events into per minute, hour and day buckets.
+
+    Only events after the last processed ``click_id`` are read, so every run
+    costs the same regardless of history. Events younger than
+    ``CLICK_ROLLUP_LAG`` seconds are left for the next run, giving slower
+    writers time to commit lower ids. Workers take turns through an advisory
+    lock, a run is skipped while another worker holds it.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("click-rollup", interval=Server.CLICK_ROLLUP_INTERVAL)
+
+    async def run_once(self) -> None:
+        async with self.pool.acquire() as con, con.transaction():
+            locked = await con.fetchval(
+                "SELECT pg_try_advisory_xact_lock(hashtext('url_click_rollups'))"
+            )
+            if not locked:
+                return
+            last_click_id = await con.fetchval(
+                """SELECT last_click_id FROM rollup_progress
+                WHERE name = 'url_clicks' FOR UPDATE"""
+            )
+            upto, eligible = await con.fetchrow(
+                """SELECT max(click_id), count(*) FROM (
+                    SELECT click_id FROM url_clicks
+                    WHERE click_id > $1
+                    AND clicked_at < now() - make_interval(secs => $2)
+                    ORDER BY click_id LIMIT $3
+                ) batch""",
+                last_click_id,
+                Server.CLICK_ROLLUP_LAG,
+                Server.CLICK_ROLLUP_BATCH_SIZE,
+            )
+            if not eligible:
+                return
+            # events below upto that are still within the lag are included too
+            count = await con.fetchval(
+                """WITH batch AS (
+                    SELECT url_key, clicked_at FROM url_clicks
+                    WHERE click_id > $1 AND click_id <= $2
+                ), upserted AS (
+                    INSERT INTO url_click_rollups (url_key, resolution, bucket, clicks)
+                    SELECT
+                        url_key,
+                        r.resolution,
+                        date_trunc(r.resolution, clicked_at, 'UTC'),
+                        count(*)
+                    FROM batch CROSS JOIN unnest($3::text[]) AS r(resolution)
+                    GROUP BY 1, 2, 3
+                    ON CONFLICT (url_key, resolution, bucket)
+                    DO UPDATE SET clicks = url_click_rollups.clicks + EXCLUDED.clicks
+                )
+                SELECT count(*) FROM batch""",
+                last_click_id,
+                upto,
+                ROLLUP_RESOLUTIONS,
+            )
+            await con.execute(
+                """UPDATE rollup_progress SET last_click_id = $1
+                WHERE name = 'url_clicks'""",
+                upto,
+            )
+        rollup_clicks.add({}, count)
+        if eligible == Server.CLICK_ROLLUP_BATCH_SIZE:
+            self.wake()  # more events are waiting
+
+
+click_log = ClickLog()
+click_rollup = ClickRollup()
@@ -0,0 +1,79 @@
+import hashlib
+import hmac
+import secrets
+
+from datetime import datetime, timezone
+
+import asyncpg
+
+from loguru import logger
+
+from .constants import Server
+from .tasks import PeriodicTask
+
+KEY_PREFIX = "lemon_"
+
+
+def generate_api_key() -> str:
+    return KEY_PREFIX + secrets.token_urlsafe(32)
+
+
+def digest_api_key(key: str) -> bytes:
+    """Keyed digest of the api key, only the digest is stored."""
+    return hmac.digest(Server.SECRET_KEY.encode(), key.encode(), hashlib.sha256)
+
+
+async def fetch_api_key(
+    con: asyncpg.Connection | asyncpg.Pool, digest: bytes
+) -> asyncpg.Record | None:
+    """Find the key with its user, keys of banned users are not found."""
+    return await con.fetchrow(
+        """SELECT api_keys.key_id, api_keys.scopes, users.user_id, users.username,
+            users.scopes AS user_scopes
+        FROM api_keys JOIN users USING (user_id)
+        WHERE api_keys.digest = $1 AND NOT users.is_banned""",
+        digest,
+    )
+
+
+class LastUsedWriter(PeriodicTask):
+    """
+    Remember when api keys were used and write the times in batches.
+
+    Using a key never writes to the database, the latest use of every key is
+    written every ``API_KEY_LAST_USED_INTERVAL`` seconds with one update.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(
+            "api-key-last-used", interval=Server.API_KEY_LAST_USED_INTERVAL
+        )
+        self.pending: dict[str, datetime] = {}
+
+    def touch(self, key_id: str) -> None:
+        self.pending[key_id] = datetime.now(timezone.utc)
+
+    async def run_once(self) -> None:
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            async with self.pool.acquire() as con:
+                await con.execute(
+                    """UPDATE api_keys SET last_used_at = d.used_at
+                    FROM unnest($1::text[], $2::timestamptz[]) AS d(key_id, used_at)
+                    WHERE api_keys.key_id = d.key_id""",
+                    list(batch.keys()),
+                    list(batch.values()),
+                )
+        except BaseException:
+            # newer uses recorded meanwhile win
+            self.pending = batch | self.pending
+            raise
+        logger.trace(f"Wrote last use of {len(batch)} api keys.")
+
+    async def on_stop(self) -> None:
+        await self.run_once()
+
+
+api_key_usage = LastUsedWriter()
@@ -1,25 +1,44 @@
+import asyncio
+import hashlib
 import secrets
+import threading
+import time
 import asyncpg
 
-from typing import Annotated
+from typing import Annotated, Callable, TypeVar
+from concurrent.futures import Future, ThreadPoolExecutor
+from aioprometheus import REGISTRY, Counter, Gauge, Histogram
 from loguru import logger
 from passlib.context import CryptContext
-from pydantic import BaseModel, ValidationError
+from pydantic import AliasChoices, BaseModel, Field, model_validator
 from asyncpg import Record
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
+from datetime import datetime, timedelta, timezone
+from jose import JWTError
+from ulid import ULID
 
 from fastapi import Depends, HTTPException, Request, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 
 from lemonapi.utils.constants import Server
 from lemonapi.utils import dependencies
+from lemonapi.utils.api_keys import api_key_usage, digest_api_key, fetch_api_key
+from lemonapi.utils.cache import TTLCache
+from lemonapi.utils.revocation import revoked_tokens, session_salts
+from lemonapi.utils.scope_registry import scope_registry
+from lemonapi.utils.signing import key_ring
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # oauth2 security scheme
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="token",
     description="OAuth security scheme",
+    auto_error=False,
+)
+# machine clients authenticate with an api key instead of a token
+api_key_header = APIKeyHeader(
+    name="X-API-Key",
+    description="API key security scheme",
+    auto_error=False,
 )
 
 
@@ -38,8 +57,19 @@ class User(BaseModel):
     user_id: str
     email: str | None = None
     full_name: str | None = None
-    is_disabled: bool | None = None
+    # the database column is called is_banned
+    is_disabled: bool | None = Field(
+        default=None, validation_alias=AliasChoices("is_disabled", "is_banned")
+    )
     scopes: list[str] = []
+    # scopes and the scopes they imply, see scope_registry.py
+    scope_mask: int | None = Field(default=None, exclude=True)
+
+    @model_validator(mode="after")
+    def compute_scope_mask(self) -> "User":
+        if self.scope_mask is None:
+            self.scope_mask = scope_registry.mask(self.scopes)
+        return self
 
 
 class UserInDB(User):
@@ -53,6 +83,22 @@ class NewUser(BaseModel):
     full_name: str
 
 
+class NewApiKey(BaseModel):
+    name: str
+    scopes: list[str] = []
+
+
+class ApiKeyCreated(NewApiKey):
+    """Used as a response for creating an api key, the key is not shown again."""
+
+    key_id: str
+    api_key: str
+
+
+class RevokeToken(BaseModel):
+    token: str
+
+
 class RefreshToken(BaseModel):
     refresh_token: str
 
@@ -66,9 +112,208 @@ class AccessToken(RefreshToken):
     refresh_token: str
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+T = TypeVar("T")
+
+hash_queue_depth = Gauge(
+    "password_hash_queue_depth",
+    "Password hash operations running or waiting for a thread.",
+    registry=REGISTRY,
+)
+hash_wait_time = Histogram(
+    "password_hash_wait_seconds",
+    "Time password hash operations waited for a thread.",
+    registry=REGISTRY,
+)
+hash_rejected = Counter(
+    "password_hash_rejected",
+    "Password hash operations rejected because the queue was full.",
+    registry=REGISTRY,
+)
+
+
+class PasswordHasher:
+    """
+    Run bcrypt on a bounded thread pool instead of the event loop.
+
+    A single hash takes hundreds of milliseconds which would stall every other
+    request of the worker. bcrypt releases the GIL, so threads are enough.
+
+    Parameters
+    ----------
+    workers : int
+        Number of threads hashing at once.
+    max_queue : int
+        Number of operations allowed to wait for a thread, more are rejected
+        with 503.
+    """
+
+    def __init__(self, workers: int, max_queue: int) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hasher"
+        )
+        self.max_pending = workers + max_queue
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                hash_rejected.inc({})
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy, try again later.",
+                    headers={"Retry-After": "1"},
+                )
+            self.pending += 1
+            hash_queue_depth.set({}, self.pending)
+        queued_at = time.perf_counter()
+
+        def timed() -> tuple[float, T]:
+            return time.perf_counter() - queued_at, func(*args)
+
+        future = self.executor.submit(timed)
+        # released when the work is done, not when the caller stops waiting,
+        # so hashes of disconnected clients still count against the bound
+        future.add_done_callback(self._release)
+        waited, result = await asyncio.wrap_future(future)
+        hash_wait_time.observe({}, waited)
+        return result
+
+    def _release(self, future: Future) -> None:
+        # called on the worker thread
+        with self._lock:
+            self.pending -= 1
+            hash_queue_depth.set({}, self.pending)
+
+
+password_hasher = PasswordHasher(
+    workers=Server.PASSWORD_HASH_WORKERS, max_queue=Server.PASSWORD_HASH_QUEUE
+)
+# user_id -> UserInDB
+user_cache = TTLCache(
+    "users", maxsize=Server.USER_CACHE_SIZE, ttl=Server.USER_CACHE_TTL
+)
+# session_id -> (user_id, salt)
+session_cache = TTLCache(
+    "sessions", maxsize=Server.USER_CACHE_SIZE, ttl=Server.USER_CACHE_TTL
+)
+# digest of api key -> (key_id, User)
+api_key_cache = TTLCache(
+    "api_keys", maxsize=Server.API_KEY_CACHE_SIZE, ttl=Server.API_KEY_CACHE_TTL
+)
+# sha256 of token -> claims
+token_cache = TTLCache("tokens", maxsize=Server.TOKEN_CACHE_SIZE, ttl=0)
+
+
+def decode_token(token: str) -> dict:
+    """
+    Verify the signature of the token and return its claims.
+
+    Claims are cached until the token expires, tokens presented again skip
+    decoding and verification. The returned dict is shared, do not modify it.
+
+    Parameters
+    ----------
+    token : str
+        Encoded token.
+
+    Returns
+    -------
+    dict
+        Claims of the token, expired tokens are returned too.
+
+    Raises
+    ------
+    JWTError
+        When the token is invalid.
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    if (claims := token_cache.get(digest)) is not None:
+        return claims
+    claims = key_ring.verify(token)
+    expires_in = float(claims.get("expiration", 0)) - datetime.utcnow().timestamp()
+    token_cache.set(digest, claims, ttl=expires_in)
+    return claims
+
+
+def expiration_time(claims: dict) -> datetime:
+    """Expiration of the token as an aware datetime."""
+    # expiration claims are timestamps of naive UTC times, undo that
+    return datetime.fromtimestamp(claims["expiration"]).replace(tzinfo=timezone.utc)
+
+
+async def is_token_revoked(
+    con: asyncpg.Connection | asyncpg.Pool, claims: dict
+) -> bool:
+    """
+    Check if the token was revoked, without a query once revocations are loaded.
+
+    Parameters
+    ----------
+    con : asyncpg.Connection | asyncpg.Pool
+        Database connection, only used before revocations are loaded.
+    claims : dict
+        Decoded token.
+
+    Returns
+    -------
+    bool
+        True if the token was revoked, tokens without jti cannot be revoked.
+    """
+    if (jti := claims.get("jti")) is None:
+        return False
+    revoked = revoked_tokens.is_revoked(jti)
+    if revoked is None:
+        revoked = await con.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM revoked_tokens WHERE jti = $1)", jti
+        )
+    return revoked
+
+
+async def revoke_token(pool: asyncpg.Pool, token: str) -> None:
+    """
+    Revoke a single token before it expires.
+
+    Parameters
+    ----------
+    pool : asyncpg.Pool
+        Database connection pool.
+    token : str
+        Access or refresh token to revoke.
+
+    Raises
+    ------
+    HTTPException
+        When the token is invalid or cannot be revoked.
+    """
+    try:
+        claims = decode_token(token)
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if "jti" not in claims or "expiration" not in claims:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Token cannot be revoked",
+        )
+    expires_at = expiration_time(claims)
+    async with pool.acquire() as con:
+        await con.execute(
+            """INSERT INTO revoked_tokens (jti, expires_at) VALUES ($1, $2)
+            ON CONFLICT DO NOTHING""",
+            claims["jti"],
+            expires_at,
+        )
+    revoked_tokens.add(claims["jti"], expires_at)
+    logger.info(f"Token {claims['jti']} of user {claims.get('id')} revoked")
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
-    Function to verify the password.
+    Function to verify the password, runs on the password hasher threads.
 
     Parameters
     ----------
@@ -81,13 +326,21 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     -------
     bool
         True if the password matches, False otherwise.
+
+    Raises
+    ------
+    HTTPException
+        When too many passwords are being hashed already.
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return await password_hasher.run(
+        pwd_context.verify, plain_password, hashed_password
+    )
 
 
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """
-    Function to hash the password from given string.
+    Function to hash the password from given string, runs on the password hasher
+    threads.
 
     Parameters
     ----------
@@ -98,18 +351,25 @@ def get_password_hash(password: str) -> str:
     -------
     str
         The hashed password.
+
+    Raises
+    ------
+    HTTPException
+        When too many passwords are being hashed already.
     """
-    return pwd_context.hash(password)
+    return await password_hasher.run(pwd_context.hash, password)
 
 
-async def get_user(username: str, con: asyncpg.Connection) -> UserInDB | None:
+async def get_user(
+    username: str, con: asyncpg.Connection | asyncpg.Pool
+) -> UserInDB | None:
     """
     Parameters
     ----------
     username : str
         Username of the user.
-    db : Annotated[Connection, Depends]
-        Database connection from session.
+    con : asyncpg.Connection | asyncpg.Pool
+        Database connection, or the pool to run the query on any connection.
 
     Returns
     -------
@@ -124,6 +384,133 @@ async def get_user(username: str, con: asyncpg.Connection) -> UserInDB | None:
     return None
 
 
+async def get_user_by_id(pool: asyncpg.Pool, user_id: str) -> UserInDB | None:
+    """
+    Get the user by id, cached. Concurrent requests share a single query.
+
+    Parameters
+    ----------
+    pool : asyncpg.Pool
+        Database connection pool.
+    user_id : str
+        The id of the user.
+
+    Returns
+    -------
+    UserInDB | None
+        Return None if user is not found.
+    """
+
+    async def load() -> UserInDB | None:
+        async with pool.acquire() as con:
+            row = await con.fetchrow("SELECT * FROM users WHERE user_id = $1", user_id)
+        return None if row is None else UserInDB(**dict(row))
+
+    return await user_cache.get_or_load(user_id, load)
+
+
+async def get_session_user(
+    pool: asyncpg.Pool, session_id: str | None, user_id: str, salt: str | None
+) -> UserInDB | None:
+    """
+    Get the user of the session if salt is the current salt of the session.
+
+    Sessions are cached by id. A token with a different salt than the cached
+    session reloads the session, either the entry or the token is out of date.
+
+    Parameters
+    ----------
+    pool : asyncpg.Pool
+        Database connection pool.
+    session_id : str | None
+        Session from the token of the user.
+    user_id : str
+        The id of the user.
+    salt : str | None
+        Salt from the token of the user.
+
+    Returns
+    -------
+    UserInDB | None
+        Return None if the session or user is not found or the salt is not
+        current.
+    """
+    if session_id is None:
+        return None
+
+    async def load() -> tuple[str, str] | None:
+        async with pool.acquire() as con:
+            row = await con.fetchrow(
+                """SELECT user_id, salt FROM sessions
+                WHERE session_id = $1 AND expires_at > now()""",
+                session_id,
+            )
+        return None if row is None else (row["user_id"], row["salt"])
+
+    session = await session_cache.get_or_load(session_id, load)
+    if session is not None and session != (user_id, salt):
+        session = await load()
+        if session is not None:
+            session_cache.set(session_id, session)
+    if session != (user_id, salt):
+        return None
+    return await get_user_by_id(pool, user_id)
+
+
+def forget_user(user_id: str) -> None:
+    """Drop the cached user after it was changed, call after every update."""
+    user_cache.invalidate(user_id)
+
+
+def forget_session(session_id: str) -> None:
+    """Revoke the tokens of a deleted session in this worker right away."""
+    session_cache.invalidate(session_id)
+    session_salts.update(session_id, None)
+
+
+async def get_api_key_user(pool: asyncpg.Pool, api_key: str) -> User | None:
+    """
+    Get the user of the api key, cached by the digest of the key.
+
+    The user has the scopes of the key, limited to the scopes the user has.
+
+    Parameters
+    ----------
+    pool : asyncpg.Pool
+        Database connection pool.
+    api_key : str
+        Api key from the X-API-Key header.
+
+    Returns
+    -------
+    User | None
+        Return None if the key does not exist or the user is banned.
+    """
+    digest = digest_api_key(api_key)
+
+    async def load() -> tuple[str, User] | None:
+        row = await fetch_api_key(pool, digest)
+        if row is None:
+            return None
+        scope_mask = scope_registry.mask(row["scopes"]) & scope_registry.mask(
+            row["user_scopes"]
+        )
+        user = User(
+            user_id=row["user_id"],
+            username=row["username"],
+            scopes=row["scopes"],
+            scope_mask=scope_mask,
+        )
+        return row["key_id"], user
+
+    cached = await api_key_cache.get_or_load(digest, load)
+    if cached is None:
+        return None
+    key_id, user = cached
+    api_key_usage.touch(key_id)
+    return user
+
+
 async def authenticate_user(
     username: str,
     password: str,
@@ -133,14 +520,17 @@ async def authenticate_user(
     """
     Authenticate the user with username and password.
 
+    The user is read with a single query. Pass the pool rather than a
+    connection, so no connection is held while the password is verified.
+
     Parameters
     ----------
     username : str
         Username of the user.
     password : str
         Password of the user.
-    db : Annotated[Connection, Depends
-        Database connection from session.
+    pool : asyncpg.Pool
+        Database connection pool.
 
     Returns
     -------
@@ -151,7 +541,7 @@ async def authenticate_user(
     if not user:
         logger.warning(f"Incorrect username attempt from IP: {request.client.host}")
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         if request:
             logger.warning(f"Incorrect password attempt from IP: {request.client.host}")
         else:
@@ -162,43 +552,83 @@ async def authenticate_user(
 
 
 async def reset_refresh_token(
-    con: asyncpg.Connection, user_id: str
-) -> tuple[str, Record]:
+    con: asyncpg.Connection | asyncpg.Pool,
+    user_id: str,
+    session_id: str | None = None,
+    device: str | None = None,
+) -> tuple[str, Record | None]:
     """
-    Reset the refresh token for the user or receive it.
+    Reset the refresh token of a session, or start a new session.
+
+    Every login starts its own session, so users can be logged in on many
+    devices and logins do not update the users row.
 
     Parameters
     ----------
-    db : Annotated[Connection, Depends]
-        Database connection from session.
+    con : asyncpg.Connection | asyncpg.Pool
+        Database connection, or the pool to run the query on any connection.
     user_id : str
         The id of the user.
+    session_id : str | None
+        Session to reset, a new session is started if None.
+    device : str | None
+        Description of the device of a new session, e.g. its user agent.
 
     Returns
     -------
-    tuple[str, Record]
-        Tuple containing the refresh token and the row from the database.
+    tuple[str, Record | None]
+        Tuple containing the refresh token and the row from the database. The
+        row is None if the session to reset no longer exists.
     """
     # Generate 22 char long string
     token_salt = secrets.token_urlsafe(16)
 
     expiration = datetime.utcnow() + timedelta(seconds=Server.REFRESH_EXPIRE_IN)
-
-    row = await con.fetchrow(
-        "UPDATE users SET key_salt = $1 WHERE user_id = $2 RETURNING *",
-        token_salt,
-        user_id,
+    session_expiration = datetime.now(timezone.utc) + timedelta(
+        seconds=Server.SESSION_EXPIRE_IN
     )
-    token = jwt.encode(
+
+    user_columns = """SELECT changed.*, users.username, users.scopes, users.is_banned
+        FROM changed JOIN users USING (user_id)"""
+    if session_id is None:
+        row = await con.fetchrow(
+            f"""WITH changed AS (
+                INSERT INTO sessions (session_id, user_id, salt, expires_at, device)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING session_id, user_id, salt
+            ) {user_columns}""",
+            str(ULID()),
+            user_id,
+            token_salt,
+            session_expiration,
+            device,
+        )
+    else:
+        row = await con.fetchrow(
+            f"""WITH changed AS (
+                UPDATE sessions SET salt = $3, expires_at = $4
+                WHERE session_id = $1 AND user_id = $2
+                RETURNING session_id, user_id, salt
+            ) {user_columns}""",
+            session_id,
+            user_id,
+            token_salt,
+            session_expiration,
+        )
+    if row is None:
+        return "", None
+    session_cache.invalidate(row["session_id"])
+    session_salts.update(row["session_id"], None if row["is_banned"] else token_salt)
+    token = key_ring.sign(
         {
             "id": row["user_id"],
+            "sid": row["session_id"],
+            "jti": str(ULID()),
             "grant_type": "refresh_token",
             "expiration": expiration.timestamp(),
             "salt": token_salt,
             "scopes": row["scopes"],
-        },
-        Server.SECRET_KEY,
-        algorithm=Server.ALGORITHM,
+        }
     )
     return token, row
 
@@ -228,7 +658,7 @@ async def create_access_token(
         When the refresh token is invalid.
     """
     try:
-        token_data = jwt.decode(refresh_token, Server.SECRET_KEY)
+        token_data = decode_token(refresh_token)
     except JWTError:
         logger.warning(f"Incorrect/Invalid token from IP: {request.client.host}")
         raise HTTPException(
@@ -239,57 +669,138 @@ async def create_access_token(
 
     expire = datetime.utcnow() + timedelta(seconds=Server.ACCESS_EXPIRE_IN)
 
+    invalid_token = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if await is_token_revoked(con, token_data):
+        logger.warning(f"Revoked token from IP: {request.client.host}")
+        raise invalid_token
     row = await con.fetchrow(
-        "SELECT user_id, key_salt, scopes FROM users WHERE user_id = $1",
+        """SELECT sessions.session_id, sessions.user_id, sessions.salt,
+            users.username, users.scopes, users.is_banned
+        FROM sessions JOIN users USING (user_id)
+        WHERE sessions.session_id = $1 AND sessions.user_id = $2
+        AND sessions.expires_at > now()""",
+        token_data.get("sid"),
         token_data["id"],
     )
     # validate salt
-    if row["key_salt"] != token_data["salt"]:
+    if row is None or row["salt"] != token_data["salt"]:
         logger.warning("Invalid salt detected")
         logger.warning(f"Incorrect/Invalid salt from IP: {request.client.host}")
 
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise invalid_token
 
     if int(token_data["expiration"]) < datetime.utcnow().timestamp():
-        refresh_token, row = await reset_refresh_token(con, row["user_id"])
+        refresh_token, row = await reset_refresh_token(
+            con, row["user_id"], session_id=row["session_id"]
+        )
+        if row is None:  # session ended meanwhile
+            raise invalid_token
 
-    token = jwt.encode(
+    token = key_ring.sign(
         {
             "id": token_data["id"],
+            "sid": row["session_id"],
+            "jti": str(ULID()),
+            "username": row["username"],
             "grant_type": "access_token",
             "expiration": expire.timestamp(),
-            "salt": row["key_salt"],
+            "salt": row["salt"],
             "scopes": row["scopes"],
-        },
-        Server.SECRET_KEY,
-        algorithm=Server.ALGORITHM,
+            "scope_mask": scope_registry.mask(row["scopes"]),
+            "scope_v": scope_registry.fingerprint,
+            "disabled": row["is_banned"],
+        }
     )
     return token, refresh_token
 
 
+def user_from_claims(payload: dict) -> User | None:
+    """
+    Build the user from the claims of an access token without the database.
+
+    Parameters
+    ----------
+    payload : dict
+        Decoded access token.
+
+    Returns
+    -------
+    User | None
+        None if the token lacks the claims or the session salts are not loaded
+        yet, the user must then be read from the database.
+
+    Raises
+    ------
+    HTTPException
+        When the token is not an access token, has expired or was revoked.
+    """
+    if "username" not in payload or "sid" not in payload:
+        return None
+    if (
+        payload.get("grant_type") != "access_token"
+        or payload.get("expiration", 0) < datetime.utcnow().timestamp()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has expired or is not an access token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    current = session_salts.is_current(payload["sid"], payload.get("salt"))
+    if current is None:
+        return None
+    if not current:
+        logger.trace("Token salt has been revoked")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    # masks minted before scopes were registered are computed again
+    if payload.get("scope_v") == scope_registry.fingerprint:
+        scope_mask = payload.get("scope_mask")
+    else:
+        scope_mask = None
+    return User(
+        user_id=payload["id"],
+        username=payload["username"],
+        scopes=payload.get("scopes") or [],
+        scope_mask=scope_mask,
+        is_disabled=payload.get("disabled"),
+    )
+
+
 async def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)],
+    token: Annotated[str | None, Depends(oauth2_scheme)],
+    api_key: Annotated[str | None, Depends(api_key_header)],
     pool: dependencies.PoolDep,
     request: Request,
 ):
     """
     Get the current user.
 
+    With ``STATELESS_AUTH`` enabled the user is built from the claims of the
+    token and the database is not queried. Otherwise the user is read through
+    the session and user caches, tokens with a revoked salt are rejected.
+    Requests with an api key are authenticated by the key alone.
+
     Parameters
     ----------
-    token : Annotated[str, Depends]
+    token : Annotated[str | None, Depends]
         Authorization token.
+    api_key : Annotated[str | None, Depends]
+        Api key from the X-API-Key header.
     db : Annotated[Connection, Depends]
         Database connection from session.
 
     Returns
     -------
-    UserInDB
-        user object with necessary data.
+    User
+        user object with necessary data, UserInDB when read from the database
+        or the user cache.
 
     Raises
     ------
@@ -302,30 +813,41 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": authenticate_value},
     )
-    async with pool.acquire() as con:
-        try:
-            payload = jwt.decode(
-                token, Server.SECRET_KEY, algorithms=[Server.ALGORITHM]
-            )
-            u_id: str = payload.get("id")
-            if u_id is None:
-                raise credentials_exception
-            username = await con.fetchrow(
-                "SELECT username FROM users WHERE user_id = $1", u_id
-            )
-            token_data = TokenData(username=str(username[0]))
-        except (JWTError, ValidationError):
-            host = request.client.host
-            logger.warning(
-                f"""Incorrect/Invalid token from IP: {
-                    host if host is not None
-                    else 'Unavailable'}"""
-            )
-            logger.trace("JWT Error, invalid token")
+    if api_key is not None:
+        user = await get_api_key_user(pool, api_key)
+        if user is None:
+            logger.warning(f"Invalid api key from IP: {request.client.host}")
             raise credentials_exception
-        user = await get_user(username=token_data.username, con=con)
+        return user
+    if token is None:
+        raise credentials_exception
+    try:
+        payload = decode_token(token)
+        u_id: str = payload.get("id")
+        if u_id is None:
+            raise credentials_exception
+    except JWTError:
+        host = request.client.host
+        logger.warning(
+            f"""Incorrect/Invalid token from IP: {
+                host if host is not None
+                else 'Unavailable'}"""
+        )
+        logger.trace("JWT Error, invalid token")
+        raise credentials_exception
+
+    if await is_token_revoked(pool, payload):
+        logger.trace("Token has been revoked")
+        raise credentials_exception
+
+    if Server.STATELESS_AUTH:
+        user = user_from_claims(payload)
+        if user is not None:
+            return user
+
+    user = await get_session_user(pool, payload.get("sid"), u_id, payload.get("salt"))
     if user is None:
-        logger.trace("User not found but ID was in token")
+        logger.trace("User or session not found or salt revoked but ID was in token")
         raise credentials_exception
     return user
 
@@ -355,3 +877,38 @@ async def get_current_active_user(
         logger.info(f"Inactive user requested: {current_user} ")
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+
+async def get_current_session_user(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    api_key: Annotated[str | None, Depends(api_key_header)],
+) -> User:
+    """
+    Get the current active user authenticated with a token from a login.
+
+    Used by routes that manage credentials. An api key may only hold a few
+    scopes, it must not be able to change the password or create other keys.
+
+    Parameters
+    ----------
+    current_user : Annotated[User, Depends]
+        Current user that is received from get_current_active_user.
+    api_key : Annotated[str | None, Depends]
+        Api key from the X-API-Key header.
+
+    Returns
+    -------
+    User
+        user object with necessary data.
+
+    Raises
+    ------
+    HTTPException
+        When the user is authenticated with an api key.
+    """
+    if api_key is not None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Api keys can not manage credentials",
+        )
+    return current_user
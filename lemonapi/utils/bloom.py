@@ -0,0 +1,188 @@
+import hashlib
+import math
+
+from aioprometheus import REGISTRY, Counter, Gauge
+from loguru import logger
+
+from .constants import Server
+from .keys import key_id
+from .tasks import ListeningTask
+
+filter_keys = Gauge("url_filter_keys", "Keys in the url key filter.", registry=REGISTRY)
+filter_memory = Gauge(
+    "url_filter_memory_bytes", "Memory used by the url key filter.", registry=REGISTRY
+)
+filter_error_rate = Gauge(
+    "url_filter_false_positive_rate",
+    "Estimated false positive rate of the url key filter.",
+    registry=REGISTRY,
+)
+filter_rejections = Counter(
+    "url_filter_rejections",
+    "Lookups of url keys rejected by the filter without a database query.",
+    registry=REGISTRY,
+)
+filter_false_positives = Counter(
+    "url_filter_false_positives",
+    "Lookups passed by the url key filter that did not exist in the database.",
+    registry=REGISTRY,
+)
+
+
+class BloomFilter:
+    """
+    Probabilistic set, membership tests have no false negatives.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of items the filter is sized for.
+    error_rate : float
+        Wanted false positive rate when the filter holds capacity items.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> list[int]:
+        # double hashing, k positions from two 64 bit hashes
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+    @property
+    def false_positive_rate(self) -> float:
+        return (
+            1 - math.exp(-self.hash_count * self.count / self.size)
+        ) ** self.hash_count
+
+
+class UrlKeyFilter(ListeningTask):
+    """
+    Bloom filter of all active url keys, lets lookups of missing keys skip the
+    database.
+
+    The filter is built when the app starts and rebuilt every
+    ``URL_FILTER_REBUILD_INTERVAL`` seconds. Keys created by any worker are
+    added through the ``url_keys`` notification channel, keys created by this
+    worker are added right away and their notification is skipped, so keys are
+    not counted twice. Removed keys cannot be taken out of a bloom filter, they
+    only cause a database query until the next rebuild, which happens early if
+    many keys have been removed. Until the filter is built every key is assumed
+    to exist.
+
+    A key created by another worker is missing from the filter until its
+    notification arrives. Keys are derived from sequence ids, so keys whose id
+    is within ``URL_FILTER_RECENT_IDS`` of the newest id seen are never
+    rejected, those are looked up in the database instead.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(
+            "url-key-filter",
+            interval=Server.URL_FILTER_REBUILD_INTERVAL,
+            channel="url_keys",
+        )
+        self.filter: BloomFilter | None = None
+        self.removed = 0
+        self._building: BloomFilter | None = None
+        # highest url_key_ids value seen when building or adding keys
+        self.latest_id: int | None = None
+        # keys added by this worker whose notification has not arrived yet
+        self._added_locally: set[str] = set()
+
+    def might_contain(self, url_key: str) -> bool:
+        if self.filter is None or url_key in self.filter or self._is_recent(url_key):
+            return True
+        filter_rejections.inc({})
+        return False
+
+    def _is_recent(self, url_key: str) -> bool:
+        if self.latest_id is None:
+            return True
+        recent = Server.URL_FILTER_RECENT_IDS
+        return self.latest_id - recent < key_id(url_key) <= self.latest_id + recent
+
+    def add(self, url_key: str) -> None:
+        """Add a key created by this worker."""
+        if self.listening:
+            self._added_locally.add(url_key)
+        self._add(url_key)
+
+    def _add(self, url_key: str) -> None:
+        for bloom in (self.filter, self._building):
+            if bloom is not None:
+                bloom.add(url_key)
+        if self.latest_id is not None:
+            self.latest_id = max(self.latest_id, key_id(url_key))
+        if self.filter is not None:
+            self._report()
+
+    def remove(self, url_key: str) -> None:
+        self.removed += 1
+        if self.filter is not None and self.removed > self.filter.count // 10:
+            self.wake()
+
+    def record_false_positive(self, url_key: str) -> None:
+        # recent keys are looked up without being in the filter
+        if self.filter is not None and url_key in self.filter:
+            filter_false_positives.inc({})
+
+    async def refresh(self) -> None:
+        async with self.pool.acquire() as con:
+            # ids handed out later are newer than any key read below
+            latest_id = await con.fetchval("SELECT last_value FROM url_key_ids")
+            count = await con.fetchval("SELECT count(*) FROM urls WHERE is_active")
+            # keys notified while reading are added to both filters
+            self._building = BloomFilter(
+                capacity=max(Server.URL_FILTER_CAPACITY, count * 2),
+                error_rate=Server.URL_FILTER_ERROR_RATE,
+            )
+            async with con.transaction():
+                async for row in con.cursor(
+                    "SELECT url_key FROM urls WHERE is_active", prefetch=10_000
+                ):
+                    self._building.add(row["url_key"])
+        self.filter, self._building = self._building, None
+        self.latest_id = max(latest_id, self.latest_id or 0)
+        self.removed = 0
+        self._report()
+        logger.info(f"Url key filter built with {self.filter.count} keys.")
+
+    def _report(self) -> None:
+        filter_keys.set({}, self.filter.count)
+        filter_memory.set({}, self.filter.memory_bytes)
+        filter_error_rate.set({}, self.filter.false_positive_rate)
+
+    def on_notification(self, url_key: str) -> None:
+        if url_key in self._added_locally:
+            self._added_locally.discard(url_key)
+        else:
+            self._add(url_key)
+
+    def on_listener_lost(self) -> None:
+        # keys created elsewhere in the meantime would be rejected
+        self.filter = None
+        self._added_locally.clear()  # their notifications are lost
+
+
+url_key_filter = UrlKeyFilter()
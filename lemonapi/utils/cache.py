@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from aioprometheus import REGISTRY, Counter
+
+# Shared by every cache, told apart by the "cache" label.
+cache_hits = Counter("cache_hits", "Number of cache hits.", registry=REGISTRY)
+cache_misses = Counter("cache_misses", "Number of cache misses.", registry=REGISTRY)
+cache_evictions = Counter(
+    "cache_evictions",
+    "Number of cache entries evicted due to size or expiry.",
+    registry=REGISTRY,
+)
+
+
+class TTLCache:
+    """Bounded in-process cache evicting by least recent use and by age.
+
+    Parameters
+    ----------
+    name : str
+        Name of the cache, used as the label of the exported metrics.
+    maxsize : int
+        Maximum number of entries held, least recently used entry is evicted first.
+    ttl : float
+        Default lifetime of an entry in seconds.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._labels = {"cache": name}
+        # key -> (expires_at, value), ordered from least to most recently used
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._loading: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Return cached value for key or None if it is missing or expired."""
+        entry = self._data.get(key)
+        if entry is None:
+            cache_misses.inc(self._labels)
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            cache_evictions.inc(self._labels)
+            cache_misses.inc(self._labels)
+            return None
+        self._data.move_to_end(key)
+        cache_hits.inc(self._labels)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Store value for key, optionally overriding the default lifetime."""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            cache_evictions.inc(self._labels)
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: float | None = None,
+    ) -> Any:
+        """Return cached value or load and cache it.
+
+        Concurrent calls for the same missing key share a single call of loader.
+        Values of None are returned but not cached.
+        """
+        if (value := self.get(key)) is not None:
+            return value
+        if (future := self._loading.get(key)) is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        else:
+            future.set_result(value)
+            # skip caching if the key was invalidated while loading
+            if value is not None and self._loading.get(key) is future:
+                self.set(key, value, ttl=ttl)
+            return value
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+
+    def invalidate(self, key: Hashable) -> None:
+        """Remove key from the cache if present."""
+        self._data.pop(key, None)
+        self._loading.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._loading.clear()
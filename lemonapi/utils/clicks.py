@@ -0,0 +1,62 @@
+import random
+
+from collections import Counter as DeltaCounter
+
+from loguru import logger
+
+from .constants import Server
+from .tasks import PeriodicTask
+
+
+class ClickCounter(PeriodicTask):
+    """Accumulate redirect clicks in memory and write them in batches.
+
+    Recording a click never touches the database. Pending deltas are flushed
+    every ``CLICK_FLUSH_INTERVAL`` seconds, or sooner once
+    ``CLICK_FLUSH_THRESHOLD`` distinct urls are pending, with a single upsert
+    into ``url_counters``. Each flush picks one of ``URL_COUNTER_SHARDS`` rows
+    per url at random so workers rarely update the same row at once. Rows
+    are upserted in url_id order, so concurrent flushes lock them in the same
+    order and can not deadlock.
+    Whatever is left is flushed on shutdown.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("click-counter", interval=Server.CLICK_FLUSH_INTERVAL)
+        self.pending: DeltaCounter[str] = DeltaCounter()
+
+    def record(self, url_key: str) -> None:
+        self.pending[url_key] += 1
+        if len(self.pending) >= Server.CLICK_FLUSH_THRESHOLD:
+            self.wake()
+
+    async def run_once(self) -> None:
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, DeltaCounter()
+        try:
+            async with self.pool.acquire() as con:
+                await con.execute(
+                    """INSERT INTO url_counters (url_id, shard, clicks)
+                    SELECT urls.url_id, $3, d.delta
+                    FROM unnest($1::text[], $2::int8[]) AS d(url_key, delta)
+                    JOIN urls USING (url_key)
+                    ORDER BY urls.url_id
+                    ON CONFLICT (url_id, shard)
+                    DO UPDATE SET clicks = url_counters.clicks + EXCLUDED.clicks""",
+                    list(batch.keys()),
+                    list(batch.values()),
+                    random.randrange(Server.URL_COUNTER_SHARDS),
+                )
+        except BaseException:
+            # keep the clicks for the next flush instead of losing them, this
+            # includes cancellation on shutdown
+            self.pending.update(batch)
+            raise
+        logger.trace(f"Flushed clicks of {len(batch)} urls.")
+
+    async def on_stop(self) -> None:
+        await self.run_once()
+
+
+click_counter = ClickCounter()
@@ -17,8 +17,41 @@ class _Server(BaseSettings):
     # the 4 constants below are used in authentication file (auth.py)
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
+    # private keys in PEM files used with RS256 or ES256, the first one signs and
+    # the others still verify tokens signed before a key rotation
+    SIGNING_KEY_FILES: list[str] = []
     ACCESS_EXPIRE_IN: int = 3600  # value in seconds
     REFRESH_EXPIRE_IN: int = ACCESS_EXPIRE_IN * 6
+    # bcrypt runs on a thread pool, requests beyond the queue are answered with 503
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE: int = 32
+    # trust the claims of access tokens instead of reading the user from the
+    # database, revoked tokens are found from an in-memory map of session salts
+    # reloaded every SESSION_SALTS_REFRESH_INTERVAL seconds
+    STATELESS_AUTH: bool = False
+    SESSION_SALTS_REFRESH_INTERVAL: float = 300.0
+    # a session outlives its refresh token, expired refresh tokens can still be
+    # exchanged until the session expires. Expired sessions are deleted in
+    # batches, values in seconds
+    SESSION_EXPIRE_IN: int = REFRESH_EXPIRE_IN * 4
+    SESSION_REAPER_INTERVAL: float = 300.0
+    SESSION_REAPER_BATCH_SIZE: int = 1000
+    # single tokens can be revoked, every worker polls for new revocations.
+    # rows of expired tokens are deleted by a reaper, values in seconds
+    REVOKED_TOKENS_POLL_INTERVAL: float = 5.0
+    REVOKED_TOKENS_POLL_OVERLAP: float = 5.0
+    REVOKED_TOKENS_REAPER_INTERVAL: float = 3600.0
+    # users and sessions read by get_current_user are cached by id, ttl value in
+    # seconds. changes made by other workers are seen once the entry expires.
+    USER_CACHE_SIZE: int = 10_000
+    USER_CACHE_TTL: int = 30
+    # verified token claims are cached until the token expires
+    TOKEN_CACHE_SIZE: int = 10_000
+    # api keys found by digest are cached, revoked keys stay usable on other
+    # workers until the entry expires. ttl and interval values in seconds
+    API_KEY_CACHE_SIZE: int = 10_000
+    API_KEY_CACHE_TTL: int = 60
+    API_KEY_LAST_USED_INTERVAL: float = 60.0
 
     DEBUG: bool
 
@@ -31,11 +64,52 @@ class _Server(BaseSettings):
     TEMPLATES: Jinja2Templates = Jinja2Templates(directory="lemonapi/templates")
 
     SCOPES: list[str] = ["users:read"]
+    # scopes granted by a scope, "users:*" grants every scope starting with "users:"
+    SCOPE_HIERARCHY: dict[str, list[str]] = {"admin": ["users:*"]}
     # key length is used for shortened urls.
     # value of default 5 geneerates shortened urls like:
     # http://localhost:5000/UEFIS
     KEY_LENGTH: int = 5
     SECRET_KEY_LENGTH: int = 10
+    # url keys are allocated from a database sequence, ids are reserved in blocks
+    # and shuffled so that keys are not sequential.
+    URL_KEY_BLOCK_SIZE: int = 100
+    OBFUSCATE_URL_KEYS: bool = True
+    # max number of urls accepted by bulk creation and rows inserted at once
+    BULK_URL_LIMIT: int = 100_000
+    BULK_URL_CHUNK_SIZE: int = 1000
+    # max number of keys resolved by one request and rows streamed at once
+    RESOLVE_URL_LIMIT: int = 100_000
+    RESOLVE_URL_CHUNK_SIZE: int = 1000
+    # expired urls are deleted in batches, interval value in seconds
+    URL_REAPER_INTERVAL: float = 60.0
+    URL_REAPER_BATCH_SIZE: int = 1000
+    # responses to url creation are kept for retries with the same Idempotency-Key
+    IDEMPOTENCY_CACHE_SIZE: int = 10_000
+    IDEMPOTENCY_TTL: int = 300
+
+    # in-process cache of short url resolutions, ttl value in seconds
+    URL_CACHE_SIZE: int = 10_000
+    URL_CACHE_TTL: int = 60
+    # bloom filter of url keys, sized for at least URL_FILTER_CAPACITY keys
+    URL_FILTER_CAPACITY: int = 1_000_000
+    URL_FILTER_ERROR_RATE: float = 0.01
+    URL_FILTER_REBUILD_INTERVAL: int = 3600
+    # keys allocated within this many ids of the newest key a worker has seen may
+    # not have reached its filter yet, lookups of those always query the database
+    URL_FILTER_RECENT_IDS: int = 100_000
+    # clicks are written in batches, interval value in seconds
+    CLICK_FLUSH_INTERVAL: float = 5.0
+    CLICK_FLUSH_THRESHOLD: int = 1000
+    # counter rows per url, more shards spread updates of very popular urls
+    URL_COUNTER_SHARDS: int = 1
+    # click events buffered in memory before they are dropped
+    CLICK_LOG_SIZE: int = 100_000
+    CLICK_LOG_FLUSH_INTERVAL: float = 1.0
+    # click events are aggregated into rollups for stats, values in seconds
+    CLICK_ROLLUP_INTERVAL: float = 10.0
+    CLICK_ROLLUP_LAG: float = 30.0
+    CLICK_ROLLUP_BATCH_SIZE: int = 100_000
 
 
 Server = _Server()
@@ -1,14 +1,68 @@
 import secrets
 import string
 
-from typing import Annotated
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlunsplit
+
+from typing import Annotated, AsyncIterator, NamedTuple
 from loguru import logger
 from ulid import ULID
+from asyncpg import Connection, Record
 
 from fastapi import status, HTTPException, Depends
 
 from . import schemas, auth, dependencies
+from .api_keys import digest_api_key, generate_api_key
+from .bloom import url_key_filter
+from .cache import TTLCache
+from .clicks import click_counter
 from .constants import Server
+from .keys import KEY_PATTERN, key_allocator
+from .scope_registry import scope_registry
+
+
+class ResolvedURL(NamedTuple):
+    target_url: str
+    is_active: bool
+    expires_at: datetime | None = None
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= datetime.now(
+            timezone.utc
+        )
+
+
+# url_key -> ResolvedURL, only active urls are cached. Entries are invalidated
+# locally on deletion, other workers rely on the ttl.
+url_cache = TTLCache("urls", maxsize=Server.URL_CACHE_SIZE, ttl=Server.URL_CACHE_TTL)
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Normalize url for finding duplicate targets.
+
+    Scheme and host are lowercased, default ports are dropped and an empty path
+    becomes "/", none of these change where the url points to.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname or ""
+    if ":" in netloc:  # IPv6 address
+        netloc = f"[{netloc}]"
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{parts.port}"
+    if "@" in parts.netloc:
+        netloc = f"{parts.netloc.rpartition('@')[0]}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def forget_url(url_key: str) -> None:
+    """Drop deleted url from in-process lookup structures."""
+    url_cache.invalidate(url_key)
+    url_key_filter.remove(url_key)
 
 
 class CrudService:
@@ -27,12 +81,65 @@ class CrudService:
     async def get_db_url_by_key(self, url_key: str):
         async with self.pool.acquire() as con:
             row = await con.fetchrow(
-                "SELECT * FROM urls WHERE url_key = $1 AND is_active = $2",
+                """SELECT urls.*, (
+                    SELECT COALESCE(sum(clicks), 0)::int8 FROM url_counters
+                    WHERE url_counters.url_id = urls.url_id
+                ) AS clicks
+                FROM urls WHERE url_key = $1 AND is_active = $2""",
                 url_key,
                 True,
             )
         return row
 
+    async def get_db_urls_by_keys(self, url_keys: list[str]) -> list[Record]:
+        """Look up many urls with one query.
+
+        Inactive urls are included, keys that do not exist are left out. Rows
+        are read at once so the connection is not held while they are sent.
+        """
+        async with self.pool.acquire() as con:
+            return await con.fetch(
+                """SELECT
+                    url_key,
+                    target_url,
+                    is_active,
+                    created_at,
+                    expires_at,
+                    (
+                        SELECT COALESCE(sum(clicks), 0)::int8 FROM url_counters
+                        WHERE url_counters.url_id = urls.url_id
+                    ) AS clicks
+                FROM urls WHERE url_key = ANY($1::text[])""",
+                url_keys,
+            )
+
+    async def resolve_url(self, url_key: str) -> ResolvedURL | None:
+        """Resolve url key to its target, served from cache when possible.
+
+        Expired urls are not resolved even before the reaper has removed them.
+        """
+        if (resolved := url_cache.get(url_key)) is not None:
+            return None if resolved.expired else resolved
+        if not KEY_PATTERN.fullmatch(url_key):
+            return None
+        if not url_key_filter.might_contain(url_key):
+            return None
+        async with self.pool.acquire() as con:
+            row = await con.fetchrow(
+                """SELECT target_url, is_active, expires_at FROM urls
+                WHERE url_key = $1 AND is_active = $2""",
+                url_key,
+                True,
+            )
+        if row is None:
+            url_key_filter.record_false_positive(url_key)
+            return None
+        resolved = ResolvedURL(*row)
+        if resolved.expired:
+            return None
+        url_cache.set(url_key, resolved)
+        return resolved
+
     async def deactivate_db_url_by_secret_key(self, secret_key: str):
         async with self.pool.acquire() as con:
             db_url = await self.get_url_by_secret_key(secret_key)
@@ -41,95 +148,212 @@ class CrudService:
                     "DELETE FROM urls WHERE secret_key = $1 RETURNING *",
                     secret_key,
                 )
+                forget_url(db_url["url_key"])
             logger.info(
                 f"URL with secret key '{secret_key}' deleted from the database."
             )
         return db_url
 
-    async def create_db_url(self, url: schemas.URLBase):
-        secret_key_length = Server.SECRET_KEY_LENGTH
+    async def create_db_url(self, url: schemas.URLCreate, dedup: bool = False):
+        """Create shortened url.
 
+        With dedup an existing active url with the same normalized target and
+        expiry time is returned instead of creating a new one. Its secret key
+        belongs to whoever created it, so it is not returned. Concurrent requests
+        for a new target may still both create a url.
+        """
+        target_normalized = normalize_url(url.target_url)
         async with self.pool.acquire() as con:
-            key = await self.create_unique_random_key()
-            secret_key = (
-                f"{key}_{await self.create_random_key(length=secret_key_length)}"
+            if dedup:
+                row = await con.fetchrow(
+                    """SELECT url_key, target_url, expires_at FROM urls
+                    WHERE target_normalized = $1 AND is_active
+                    AND expires_at IS NOT DISTINCT FROM $2
+                    LIMIT 1""",
+                    target_normalized,
+                    url.expires_at,
+                )
+                if row:
+                    return {**row, "secret_key": None}
+            row = await self._insert_url(
+                con, url.target_url, target_normalized, url.expires_at
             )
+            logger.info(f"URL created with key '{row['url_key']}' in the database.")
+        return row
 
+    async def create_db_urls(
+        self, target_urls: list[str]
+    ) -> AsyncIterator[list[Record]]:
+        """Create urls in bulk, yielding created rows one chunk at a time.
+
+        Each chunk is copied into a staging table and inserted from there with a
+        single statement.
+        """
+        chunk_size = Server.BULK_URL_CHUNK_SIZE
+        for start in range(0, len(target_urls), chunk_size):
+            # no connection is held while the client reads the chunk
+            async with self.pool.acquire() as con:
+                rows = await self._create_urls(
+                    con, target_urls[start : start + chunk_size]
+                )
+            logger.info(f"{len(rows)} URLs created in bulk in the database.")
+            yield rows
+
+    async def _create_urls(self, con: Connection, chunk: list[str]) -> list[Record]:
+        keys = await key_allocator.allocate(con, count=len(chunk))
+        records = [
+            (
+                target_url,
+                key,
+                await self._create_secret_key(key),
+                normalize_url(target_url),
+            )
+            for target_url, key in zip(chunk, keys)
+        ]
+        async with con.transaction():
             await con.execute(
+                """CREATE TEMPORARY TABLE url_staging (
+                    target_url text,
+                    url_key text,
+                    secret_key text,
+                    target_normalized text
+                ) ON COMMIT DROP"""
+            )
+            await con.copy_records_to_table("url_staging", records=records)
+            rows = await con.fetch(
                 """INSERT INTO urls (
-                    target_url,
-                    url_key,
-                    secret_key) VALUES ($1, $2, $3)""",
-                url.target_url,
-                key,
-                secret_key,
+                    target_url, url_key, secret_key, target_normalized
+                ) SELECT * FROM url_staging
+                ON CONFLICT DO NOTHING
+                RETURNING url_key, target_url, secret_key"""
             )
+        if len(rows) < len(records):
+            # collided with randomly generated legacy keys, retry these
+            created = {row["url_key"] for row in rows}
+            for target_url, key, _, target_normalized in records:
+                if key not in created:
+                    rows.append(
+                        await self._insert_url(con, target_url, target_normalized)
+                    )
+        for row in rows:
+            url_key_filter.add(row["url_key"])
+        return rows
+
+    async def _insert_url(
+        self,
+        con: Connection,
+        target_url: str,
+        target_normalized: str,
+        expires_at: datetime | None = None,
+    ) -> Record:
+        row = None
+        # allocated keys never collide with each other, only with keys
+        # created randomly before the allocator existed, skip those.
+        while row is None:
+            (key,) = await key_allocator.allocate(con)
             row = await con.fetchrow(
-                "SELECT url_key, target_url, secret_key FROM urls WHERE url_key = $1",
+                """INSERT INTO urls (
+                    target_url,
+                    url_key,
+                    secret_key,
+                    target_normalized,
+                    expires_at) VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT DO NOTHING
+                RETURNING url_key, target_url, secret_key, expires_at""",
+                target_url,
                 key,
+                await self._create_secret_key(key),
+                target_normalized,
+                expires_at,
             )
-            logger.info(f"URL created with key '{key}' in the database.")
+        url_key_filter.add(row["url_key"])
         return row
 
-    async def update_db_clicks(self, db_url: schemas.URL):
+    async def _create_secret_key(self, url_key: str) -> str:
+        secret = await self.create_random_key(length=Server.SECRET_KEY_LENGTH)
+        return f"{url_key}_{secret}"
+
+    async def get_url_stats(
+        self, url_key: str, minutes: int, hours: int, days: int
+    ) -> dict[str, int | list[dict]]:
+        """Total clicks of the url and clicks in the latest minute, hour and day
+        rollup buckets."""
         async with self.pool.acquire() as con:
-            await con.execute(
-                "UPDATE urls SET clicks = $1 WHERE url_key = $2",
-                db_url.clicks + 1,
-                db_url.url_key,
+            clicks = await con.fetchval(
+                """SELECT COALESCE(sum(clicks), 0)::int8 FROM url_counters
+                JOIN urls USING (url_id) WHERE url_key = $1""",
+                url_key,
             )
-            row = await con.fetchrow(
-                "SELECT * FROM urls WHERE url_key = $1", db_url.url_key
+            rows = await con.fetch(
+                """SELECT resolution, bucket, clicks FROM url_click_rollups
+                WHERE url_key = $1 AND (
+                    resolution = 'minute'
+                    AND bucket >= now() - make_interval(mins => $2)
+                    OR resolution = 'hour'
+                    AND bucket >= now() - make_interval(hours => $3)
+                    OR resolution = 'day'
+                    AND bucket >= now() - make_interval(days => $4)
+                )
+                ORDER BY bucket""",
+                url_key,
+                minutes,
+                hours,
+                days,
             )
-            return row
-
-    async def get_list_of_usernames(self) -> list[str]:
-        async with self.pool.acquire() as con:
-            rows = await con.fetch("SELECT username FROM users")
-        return [row["username"] for row in rows]
-
-    async def get_list_of_emails(self) -> list[str]:
-        async with self.pool.acquire() as con:
-            rows = await con.fetch("SELECT email FROM users")
-        return [row["email"] for row in rows]
-
-    async def add_user(self, user: auth.NewUser):
-        if user.username in await self.get_list_of_usernames():
-            logger.info(f"User with username '{user.username}' already exists.")
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Username already exists.",
-            )  # raise exception if username already exists
-
-        elif user.email in await self.get_list_of_emails():
-            logger.info(f"Email '{user.email}' already exists.")
-
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Email already exists.",
+        stats = {"clicks": clicks}
+        stats.update({resolution: [] for resolution in ("minute", "hour", "day")})
+        for row in rows:
+            stats[row["resolution"]].append(
+                {"bucket": row["bucket"], "clicks": row["clicks"]}
             )
+        return stats
+
+    def update_db_clicks(self, url_key: str) -> None:
+        """Count a click, written to the database later in a batch."""
+        click_counter.record(url_key)
 
+    async def add_user(self, user: auth.NewUser) -> Record:
+        """Add the user, duplicate usernames and emails are found by unique indexes."""
         # create user ID
         ulid = ULID()
         user_id_str = str(ulid)
+        # hash before taking a connection, hashing is slow
+        hashed_password = await auth.get_password_hash(user.password)
         async with self.pool.acquire() as con:
-            await con.execute(
+            row = await con.fetchrow(
                 """INSERT INTO users (
                     user_id,
                     username,
                     hashed_password,
                     fullname,
                     email
-                    ) VALUES ($1, $2, $3, $4, $5)""",
+                    ) VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT DO NOTHING RETURNING *""",
                 user_id_str,
                 user.username,
-                auth.get_password_hash(user.password),
+                hashed_password,
                 user.full_name,
                 user.email,
             )
-            row = await con.fetchrow(
-                "SELECT * FROM users WHERE username = $1",
-                user.username,
+            if row is None:
+                username_taken = await con.fetchval(
+                    """SELECT EXISTS (
+                        SELECT 1 FROM users WHERE lower(username) = lower($1)
+                    )""",
+                    user.username,
+                )
+        if row is None and username_taken:
+            logger.info(f"User with username '{user.username}' already exists.")
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Username already exists.",
+            )  # raise exception if username already exists
+        elif row is None:
+            logger.info(f"Email '{user.email}' already exists.")
+
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Email already exists.",
             )
         logger.info(
             f"User '{user.username}' created successfully with ID '{user_id_str}'."
@@ -137,39 +361,89 @@ class CrudService:
         return row
 
     async def update_password(self, user: auth.User, new_password: str):
-        """Update user password, fetch user from db using User object passed"""
+        """Update user password, update user in db using User object passed"""
+        # hash before taking a connection, hashing is slow
+        hashed_password = await auth.get_password_hash(new_password)
         async with self.pool.acquire() as con:
-            row = await auth.get_user(user.username, con)
-            if row is None:
-                raise HTTPException(404, detail="User not found")
-            hashed_password = auth.get_password_hash(new_password)
-            await con.execute(
-                "UPDATE users SET hashed_password = $1 WHERE user_id = $2",
-                hashed_password,
-                row["user_id"],
-            )
             row = await con.fetchrow(
-                "SELECT * FROM users WHERE user_id = $1",
-                row["user_id"],
+                "UPDATE users SET hashed_password = $1 WHERE user_id = $2 RETURNING *",
+                hashed_password,
+                user.user_id,
             )
+            if row is None:
+                raise HTTPException(404, detail="User not found")
+            auth.forget_user(user.user_id)
             logger.info(
                 f"User '{user.username}' ({user.user_id}) updated password successfully"
             )
         return row, f"Password updated to '{new_password}' successfully."
 
+    async def disable_user(self, user_id: str) -> Record:
+        """Disable the user, every token of the user is rejected from now on."""
+        async with self.pool.acquire() as con, con.transaction():
+            row = await con.fetchrow(
+                "UPDATE users SET is_banned = true WHERE user_id = $1 RETURNING *",
+                user_id,
+            )
+            sessions = await con.fetch(
+                "DELETE FROM sessions WHERE user_id = $1 RETURNING session_id",
+                user_id,
+            )
+        if row is None:
+            raise HTTPException(404, detail="User not found")
+        auth.forget_user(user_id)
+        auth.api_key_cache.clear()  # keys are cached by digest, not by user
+        for session in sessions:
+            auth.forget_session(session["session_id"])
+        logger.info(f"User '{row['username']}' ({user_id}) disabled")
+        return row
+
+    async def create_api_key(self, user: auth.User, new_key: auth.NewApiKey) -> dict:
+        """Create an api key with a subset of the scopes of the user."""
+        for scope in new_key.scopes:
+            bit = scope_registry.bits.get(scope, 0)
+            if scope not in user.scopes and not user.scope_mask & bit:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail=f"Scope '{scope}' is not granted to the user.",
+                )
+        api_key = generate_api_key()
+        key_id = str(ULID())
+        async with self.pool.acquire() as con:
+            await con.execute(
+                """INSERT INTO api_keys (key_id, user_id, digest, name, scopes)
+                VALUES ($1, $2, $3, $4, $5)""",
+                key_id,
+                user.user_id,
+                digest_api_key(api_key),
+                new_key.name,
+                new_key.scopes,
+            )
+        logger.info(f"User '{user.username}' ({user.user_id}) created api key {key_id}")
+        return {
+            "key_id": key_id,
+            "api_key": api_key,
+            "name": new_key.name,
+            "scopes": new_key.scopes,
+        }
+
+    async def revoke_api_key(self, user: auth.User, key_id: str) -> None:
+        async with self.pool.acquire() as con:
+            digest = await con.fetchval(
+                """DELETE FROM api_keys WHERE key_id = $1 AND user_id = $2
+                RETURNING digest""",
+                key_id,
+                user.user_id,
+            )
+        if digest is None:
+            raise HTTPException(404, detail="Api key not found")
+        auth.api_key_cache.invalidate(digest)
+        logger.info(f"User '{user.username}' ({user.user_id}) revoked api key {key_id}")
+
     async def create_random_key(self, length: int = Server.KEY_LENGTH) -> str:
         """Generate random key from given length to be used in url shortener."""
         chars = string.ascii_uppercase + string.digits
         return "".join(secrets.choice(chars) for _ in range(length))
 
-    async def create_unique_random_key(self) -> str:
-        """Create unique random key"""
-        key = await self.create_random_key()
-        foo = await self.get_db_url_by_key(key)
-        while foo:
-            key = await self.create_random_key()
-            foo = await self.get_db_url_by_key(key)
-        return key
-
 
 CrudServiceDep = Annotated[CrudService, Depends(CrudService)]
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import re
+import string
+
+from collections import deque
+
+import asyncpg
+
+from .constants import Server
+
+# same alphabet as random keys have always used, see CrudService.create_random_key
+KEY_ALPHABET = string.ascii_uppercase + string.digits
+KEY_REGEX = f"[A-Z0-9]{{{Server.KEY_LENGTH}}}"
+KEY_PATTERN = re.compile(KEY_REGEX)
+_FEISTEL_ROUNDS = 4
+_FEISTEL_KEY = hashlib.sha256(f"url-keys:{Server.SECRET_KEY}".encode()).digest()
+
+
+def encode_key(number: int, length: int = Server.KEY_LENGTH) -> str:
+    """Encode number to a fixed length key, inverse of `decode_key`."""
+    base = len(KEY_ALPHABET)
+    if not 0 <= number < base**length:
+        raise ValueError(f"{number} does not fit in a key of length {length}")
+    chars = []
+    for _ in range(length):
+        number, index = divmod(number, base)
+        chars.append(KEY_ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+def decode_key(key: str) -> int:
+    number = 0
+    for char in key:
+        number = number * len(KEY_ALPHABET) + KEY_ALPHABET.index(char)
+    return number
+
+
+def _round(value: int, round_number: int, mask: int) -> int:
+    digest = hashlib.blake2b(
+        value.to_bytes(8, "big") + bytes([round_number]),
+        key=_FEISTEL_KEY,
+        digest_size=8,
+    ).digest()
+    return int.from_bytes(digest, "big") & mask
+
+
+def permute(number: int, length: int = Server.KEY_LENGTH) -> int:
+    """
+    Map number to another number of the keyspace, bijective for the keyspace.
+
+    Sequential ids would produce guessable keys, so they are shuffled with a
+    feistel network keyed by the server secret. The network works on a power of
+    two domain, values outside the keyspace are walked until they land inside.
+
+    Parameters
+    ----------
+    number : int
+        Number in range 0 <= number < 36 ** length.
+    length : int
+        Length of the key, determines the size of the keyspace.
+
+    Returns
+    -------
+    int
+        Shuffled number within the same range.
+    """
+    keyspace = len(KEY_ALPHABET) ** length
+    half_bits = ((keyspace - 1).bit_length() + 1) // 2
+    mask = (1 << half_bits) - 1
+    while True:
+        left, right = number >> half_bits, number & mask
+        for round_number in range(_FEISTEL_ROUNDS):
+            left, right = right, left ^ _round(right, round_number, mask)
+        number = (left << half_bits) | right
+        if number < keyspace:
+            return number
+
+
+def unpermute(number: int, length: int = Server.KEY_LENGTH) -> int:
+    """Inverse of `permute`, returns the number that was shuffled to number."""
+    keyspace = len(KEY_ALPHABET) ** length
+    half_bits = ((keyspace - 1).bit_length() + 1) // 2
+    mask = (1 << half_bits) - 1
+    while True:
+        left, right = number >> half_bits, number & mask
+        for round_number in reversed(range(_FEISTEL_ROUNDS)):
+            left, right = right ^ _round(left, round_number, mask), left
+        number = (left << half_bits) | right
+        if number < keyspace:
+            return number
+
+
+def key_id(url_key: str) -> int:
+    """Sequence id the allocator derived url_key from.
+
+    Keys created randomly before the allocator existed map to arbitrary ids.
+    """
+    number = decode_key(url_key)
+    if Server.OBFUSCATE_URL_KEYS:
+        return unpermute(number, length=len(url_key))
+    return number
+
+
+class KeyAllocator:
+    """
+    Hand out url keys that never collide with each other.
+
+    Keys are derived from ids of the `url_key_ids` database sequence, each
+    worker reserves ids in blocks to avoid a round trip per key.
+
+    Parameters
+    ----------
+    block_size : int
+        Number of ids reserved from the database at once.
+    """
+
+    def __init__(self, block_size: int) -> None:
+        self.block_size = block_size
+        self._ids: deque[int] = deque()
+        self._lock = asyncio.Lock()
+
+    async def allocate(self, con: asyncpg.Connection, count: int = 1) -> list[str]:
+        """Return count unused keys, reserving new ids from database if needed."""
+        async with self._lock:
+            if len(self._ids) < count:
+                rows = await con.fetch(
+                    "SELECT nextval('url_key_ids') FROM generate_series(1, $1)",
+                    max(count - len(self._ids), self.block_size),
+                )
+                self._ids.extend(row[0] for row in rows)
+            ids = [self._ids.popleft() for _ in range(count)]
+
+        keyspace = len(KEY_ALPHABET) ** Server.KEY_LENGTH
+        if max(ids) >= keyspace:
+            raise RuntimeError(
+                "Url keyspace exhausted, increase KEY_LENGTH to create more urls."
+            )
+        if Server.OBFUSCATE_URL_KEYS:
+            return [encode_key(permute(id_)) for id_ in ids]
+        return [encode_key(id_) for id_ in ids]
+
+
+key_allocator = KeyAllocator(block_size=Server.URL_KEY_BLOCK_SIZE)
@@ -0,0 +1,111 @@
+import time
+
+from typing import Callable
+
+from aioprometheus import REGISTRY, Counter, Gauge
+from asyncpg import Record
+from loguru import logger
+
+from .constants import Server
+from .auth import forget_session
+from .crud import forget_url
+from .tasks import PeriodicTask
+
+rows_reaped = Counter(
+    "reaper_rows_deleted", "Rows deleted by background reapers.", registry=REGISTRY
+)
+reap_rate = Gauge(
+    "reaper_rows_per_second",
+    "Rows deleted per second during the latest reaper run.",
+    registry=REGISTRY,
+)
+
+
+class Reaper(PeriodicTask):
+    """
+    Delete rows matching a condition in small batches.
+
+    Each batch is its own short statement, so no lock is held for long and
+    other queries are not blocked. Rows locked by another worker's reaper are
+    skipped.
+
+    Parameters
+    ----------
+    name : str
+        Name of the reaper used as the metrics label.
+    table : str
+        Table to delete rows from.
+    condition : str
+        SQL condition of rows to delete.
+    returning : str
+        Columns of deleted rows passed to on_reaped.
+    on_reaped : Callable[[Record], None] | None
+        Called for each deleted row.
+    interval : float
+        Seconds between runs.
+    batch_size : int
+        Number of rows deleted per statement.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table: str,
+        condition: str,
+        returning: str = "ctid",
+        on_reaped: Callable[[Record], None] | None = None,
+        interval: float = 60,
+        batch_size: int = 1000,
+    ) -> None:
+        super().__init__(f"{name}-reaper", interval=interval)
+        self.labels = {"reaper": name}
+        self.batch_size = batch_size
+        self.on_reaped = on_reaped
+        self.query = f"""DELETE FROM {table} WHERE ctid IN (
+            SELECT ctid FROM {table} WHERE {condition}
+            LIMIT $1 FOR UPDATE SKIP LOCKED
+        ) RETURNING {returning}"""
+
+    async def run_once(self) -> None:
+        start = time.perf_counter()
+        total = 0
+        while True:
+            async with self.pool.acquire() as con:
+                rows = await con.fetch(self.query, self.batch_size)
+            total += len(rows)
+            if self.on_reaped is not None:
+                for row in rows:
+                    self.on_reaped(row)
+            if len(rows) < self.batch_size:
+                break
+
+        rows_reaped.add(self.labels, total)
+        reap_rate.set(self.labels, total / (time.perf_counter() - start))
+        if total:
+            logger.info(f"{self.name} deleted {total} rows.")
+
+
+url_reaper = Reaper(
+    "urls",
+    table="urls",
+    condition="expires_at < now()",
+    returning="url_key",
+    on_reaped=lambda row: forget_url(row["url_key"]),
+    interval=Server.URL_REAPER_INTERVAL,
+    batch_size=Server.URL_REAPER_BATCH_SIZE,
+)
+session_reaper = Reaper(
+    "sessions",
+    table="sessions",
+    condition="expires_at < now()",
+    returning="session_id",
+    on_reaped=lambda row: forget_session(row["session_id"]),
+    interval=Server.SESSION_REAPER_INTERVAL,
+    batch_size=Server.SESSION_REAPER_BATCH_SIZE,
+)
+revoked_token_reaper = Reaper(
+    "revoked_tokens",
+    table="revoked_tokens",
+    condition="expires_at < now()",
+    interval=Server.REVOKED_TOKENS_REAPER_INTERVAL,
+)
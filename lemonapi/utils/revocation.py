@@ -0,0 +1,154 @@
+import json
+import time
+
+from datetime import datetime, timedelta
+
+from aioprometheus import REGISTRY, Gauge
+from loguru import logger
+
+from .constants import Server
+from .tasks import ListeningTask, PeriodicTask
+
+salt_map_sessions = Gauge(
+    "session_salts_sessions",
+    "Sessions in the token revocation map.",
+    registry=REGISTRY,
+)
+revoked_token_count = Gauge(
+    "revoked_tokens", "Revoked tokens that have not expired yet.", registry=REGISTRY
+)
+
+
+class SessionSalts(ListeningTask):
+    """
+    Map of session_id to the current salt of every live session.
+
+    Tokens carry the session and salt they were issued with, a token whose
+    salt is no longer current has been revoked. The map is loaded when the app
+    starts, kept up to date through the ``session_salts`` notification channel
+    and reloaded every ``SESSION_SALTS_REFRESH_INTERVAL`` seconds in case a
+    notification was missed. Sessions of banned users are left out when
+    loading. Until it is loaded nothing can be decided.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(
+            "session-salts",
+            interval=Server.SESSION_SALTS_REFRESH_INTERVAL,
+            channel="session_salts",
+        )
+        self.salts: dict[str, str] | None = None
+        self._changes: dict[str, str | None] | None = None
+
+    def is_current(self, session_id: str, salt: str | None) -> bool | None:
+        """Whether salt is the current salt of the session, None if not known yet."""
+        if self.salts is None:
+            return None
+        return salt is not None and self.salts.get(session_id) == salt
+
+    def update(self, session_id: str, salt: str | None) -> None:
+        """Set the salt of a session, None revokes every token of the session."""
+        if self._changes is not None:
+            self._changes[session_id] = salt
+        if self.salts is None:
+            return
+        if salt is None:
+            self.salts.pop(session_id, None)
+        else:
+            self.salts[session_id] = salt
+        salt_map_sessions.set({}, len(self.salts))
+
+    async def refresh(self) -> None:
+        self._changes = {}
+        try:
+            async with self.pool.acquire() as con, con.transaction():
+                salts = {
+                    row["session_id"]: row["salt"]
+                    async for row in con.cursor(
+                        """SELECT sessions.session_id, sessions.salt
+                        FROM sessions JOIN users USING (user_id)
+                        WHERE NOT users.is_banned AND sessions.expires_at > now()""",
+                        prefetch=10_000,
+                    )
+                }
+            # changes notified while reading are newer than the rows read
+            changes, self._changes = self._changes, None
+        finally:
+            self._changes = None
+        self.salts = salts
+        for session_id, salt in changes.items():
+            self.update(session_id, salt)
+        salt_map_sessions.set({}, len(self.salts))
+        logger.info(f"Session salts loaded for {len(self.salts)} sessions.")
+
+    def on_notification(self, payload: str) -> None:
+        change = json.loads(payload)
+        self.update(change["id"], change["salt"])
+
+    def on_listener_lost(self) -> None:
+        # without notifications revoked tokens would stay valid
+        self.salts = None
+
+
+session_salts = SessionSalts()
+
+
+class RevokedTokens(PeriodicTask):
+    """
+    Ids (jti) of revoked tokens that have not expired yet.
+
+    All unexpired revocations are loaded when the app starts, afterwards only
+    rows revoked since the previous poll are read every
+    ``REVOKED_TOKENS_POLL_INTERVAL`` seconds. Polls overlap by
+    ``REVOKED_TOKENS_POLL_OVERLAP`` seconds so rows committed late are not
+    missed. Tokens are forgotten once they expire, their rows are deleted by a
+    reaper. Until loaded nothing can be decided.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(
+            "revoked-tokens",
+            interval=Server.REVOKED_TOKENS_POLL_INTERVAL,
+            run_on_start=True,
+        )
+        # jti -> expiration as unix time
+        self.tokens: dict[str, float] | None = None
+        self.polled_at: datetime | None = None
+
+    def is_revoked(self, jti: str) -> bool | None:
+        if self.tokens is None:
+            return None
+        return jti in self.tokens
+
+    def add(self, jti: str, expires_at: datetime) -> None:
+        """Revoke in this worker right away instead of at the next poll."""
+        if self.tokens is not None:
+            self.tokens[jti] = expires_at.timestamp()
+
+    async def run_once(self) -> None:
+        async with self.pool.acquire() as con:
+            polled_at = await con.fetchval("SELECT now()")
+            if self.tokens is None:
+                rows = await con.fetch(
+                    """SELECT jti, expires_at FROM revoked_tokens
+                    WHERE expires_at > now()"""
+                )
+                tokens = {}
+            else:
+                rows = await con.fetch(
+                    """SELECT jti, expires_at FROM revoked_tokens
+                    WHERE revoked_at > $1""",
+                    self.polled_at
+                    - timedelta(seconds=Server.REVOKED_TOKENS_POLL_OVERLAP),
+                )
+                tokens = self.tokens
+        for row in rows:
+            tokens[row["jti"]] = row["expires_at"].timestamp()
+        now = time.time()
+        for jti in [jti for jti, expires_at in tokens.items() if expires_at <= now]:
+            del tokens[jti]
+        self.tokens, self.polled_at = tokens, polled_at
+        revoked_token_count.set({}, len(tokens))
+
+
+revoked_tokens = RevokedTokens()
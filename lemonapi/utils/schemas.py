@@ -1,10 +1,24 @@
-from pydantic import BaseModel
+from datetime import datetime, timezone
+
+from pydantic import BaseModel, field_validator
 
 
 class URLBase(BaseModel):
     target_url: str
 
 
+class URLCreate(URLBase):
+    expires_at: datetime | None = None
+
+    @field_validator("expires_at")
+    @classmethod
+    def assume_utc(cls, value: datetime | None) -> datetime | None:
+        """Times without timezone are taken as UTC."""
+        if value is not None and value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
+
+
 class URL(URLBase):
     is_active: bool
     clicks: int
@@ -0,0 +1,75 @@
+import hashlib
+
+from typing import Iterable
+
+from .constants import Server
+
+
+class ScopeRegistry:
+    """
+    Bit of every known scope, scopes of a user are carried as one integer mask.
+
+    Scopes are only ever appended, the bit of a scope never changes while the
+    app runs. Workers register the same scopes in the same order at import
+    time, so their masks agree. The fingerprint changes with every
+    registration, a mask minted with another fingerprint must be recomputed
+    from the scope names.
+
+    Parameters
+    ----------
+    scopes : Iterable[str]
+        Scopes registered up front.
+    hierarchy : dict[str, list[str]]
+        Scopes implied by a scope, ``prefix:*`` implies every registered scope
+        starting with ``prefix:``.
+    """
+
+    def __init__(self, scopes: Iterable[str], hierarchy: dict[str, list[str]]) -> None:
+        self.bits: dict[str, int] = {}
+        self.hierarchy = hierarchy
+        self.fingerprint = ""
+        for scope in scopes:
+            self.register(scope)
+
+    def register(self, scope: str) -> int:
+        if (bit := self.bits.get(scope)) is None:
+            bit = self.bits[scope] = 1 << len(self.bits)
+            self.fingerprint = hashlib.blake2b(
+                "\n".join(self.bits).encode(), digest_size=8
+            ).hexdigest()
+        return bit
+
+    def require(self, scopes: Iterable[str]) -> int:
+        """Register the scopes and return the mask of exactly these scopes."""
+        mask = 0
+        for scope in scopes:
+            mask |= self.register(scope)
+        return mask
+
+    def mask(self, scopes: Iterable[str]) -> int:
+        """Mask of the scopes and every scope they imply, unknown ones are ignored."""
+        mask = 0
+        seen = set()
+        pending = list(scopes)
+        while pending:
+            scope = pending.pop()
+            if scope in seen:
+                continue
+            seen.add(scope)
+            pending.extend(self.hierarchy.get(scope, ()))
+            if scope.endswith("*"):
+                prefix = scope[:-1]
+                for name, bit in self.bits.items():
+                    if name.startswith(prefix):
+                        mask |= bit
+            else:
+                mask |= self.bits.get(scope, 0)
+        return mask
+
+    def names(self, mask: int) -> list[str]:
+        return [name for name, bit in self.bits.items() if mask & bit]
+
+
+scope_registry = ScopeRegistry(
+    [*Server.SCOPES, *Server.SCOPE_HIERARCHY], Server.SCOPE_HIERARCHY
+)
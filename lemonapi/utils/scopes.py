@@ -1,6 +1,7 @@
 from loguru import logger
 
-from .auth import User, get_current_user
+from .auth import User, get_current_active_user
+from .scope_registry import scope_registry
 
 from fastapi import Depends, HTTPException, status
 
@@ -8,6 +9,10 @@ from fastapi import Depends, HTTPException, status
 class RequiredScopes:
     """Check if user is authorized to access endpoint. Check based on scopes.
 
+    Required scopes are registered when the check is created, the check itself
+    compares the scope mask of the already authenticated user. Scopes implied
+    through ``SCOPE_HIERARCHY`` are included in that mask.
+
     Parameters
     ----------
     required_scopes : list[str]
@@ -28,16 +33,12 @@ class RequiredScopes:
 
     def __init__(self, required_scopes: list[str]) -> None:
         self.required_scopes = required_scopes
+        self.mask = scope_registry.require(required_scopes)
 
-    def __call__(self, user: User = Depends(get_current_user)) -> bool:
-        missing_permissions = [
-            permission
-            for permission in self.required_scopes
-            if permission not in user.scopes
-        ]
-
-        if missing_permissions:
-            missing_permissions_str = ", ".join(missing_permissions)
+    def __call__(self, user: User = Depends(get_current_active_user)) -> bool:
+        missing = self.mask & ~user.scope_mask
+        if missing:
+            missing_permissions_str = ", ".join(scope_registry.names(missing))
             logger.warning(
                 f"Unauthorized access attempt by user '{user.username}' {user.user_id}"
                 "to protected endpoint "
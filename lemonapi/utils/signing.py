@@ -0,0 +1,89 @@
+import base64
+import hashlib
+import json
+import pathlib
+
+from jose import JWTError, jwk, jwt
+
+from .constants import Server
+
+# members of a public key used for its thumbprint, see RFC 7638
+THUMBPRINT_MEMBERS = {"RSA": ("e", "kty", "n"), "EC": ("crv", "kty", "x", "y")}
+
+
+def thumbprint(public_key: dict) -> str:
+    """RFC 7638 thumbprint of a public JWK, used as the key id."""
+    members = {name: public_key[name] for name in THUMBPRINT_MEMBERS[public_key["kty"]]}
+    canonical = json.dumps(members, separators=(",", ":"), sort_keys=True)
+    digest = hashlib.sha256(canonical.encode()).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+class KeyRing:
+    """
+    Keys that sign and verify tokens.
+
+    With an HS algorithm the secret does both and nothing is published. With
+    an RS or ES algorithm the first private key signs and every key verifies,
+    so a new key can be put first while tokens signed with the previous one are
+    still valid. Tokens name their key in the ``kid`` header. The public keys
+    are published as a JWKS document that is built once.
+
+    Parameters
+    ----------
+    algorithm : str
+        Signing algorithm, e.g. HS256, RS256 or ES256.
+    secret : str
+        Shared secret used with HS algorithms.
+    private_keys : list[str]
+        PEM encoded private keys used with RS and ES algorithms, newest first.
+    """
+
+    def __init__(self, algorithm: str, secret: str, private_keys: list[str]) -> None:
+        self.algorithm = algorithm
+        self.signing_key = secret
+        self.kid: str | None = None
+        self.public_keys = {}
+        published = []
+        if not algorithm.startswith("HS"):
+            if not private_keys:
+                raise ValueError(f"{algorithm} needs a key in SIGNING_KEY_FILES.")
+            for private_key in private_keys:
+                private = jwk.construct(private_key, algorithm)
+                public = private.public_key()
+                public_jwk = public.to_dict()
+                kid = thumbprint(public_jwk)
+                if self.kid is None:
+                    self.signing_key, self.kid = private, kid
+                self.public_keys[kid] = public
+                published.append({**public_jwk, "kid": kid, "use": "sig"})
+        self.jwks = json.dumps({"keys": published}).encode()
+
+    def sign(self, claims: dict) -> str:
+        headers = None if self.kid is None else {"kid": self.kid}
+        return jwt.encode(
+            claims, self.signing_key, algorithm=self.algorithm, headers=headers
+        )
+
+    def verify(self, token: str) -> dict:
+        """
+        Return the claims of the token if its signature is valid.
+
+        Raises
+        ------
+        JWTError
+            When the token is invalid or signed with an unknown key.
+        """
+        if self.kid is None:
+            return jwt.decode(token, self.signing_key, algorithms=[self.algorithm])
+        key = self.public_keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise JWTError("Token is signed with an unknown key.")
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+
+key_ring = KeyRing(
+    Server.ALGORITHM,
+    Server.SECRET_KEY,
+    [pathlib.Path(path).read_text() for path in Server.SIGNING_KEY_FILES],
+)
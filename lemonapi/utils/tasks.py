@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+
+import asyncpg
+
+from loguru import logger
+
+from .database import Connection
+
+
+class PeriodicTask:
+    """Background job that runs ``run_once`` every ``interval`` seconds.
+
+    Started and stopped from the application lifespan. Subclasses may call
+    ``wake`` to run the job before the interval has passed.
+
+    Parameters
+    ----------
+    name : str
+        Name of the job used in logs.
+    interval : float
+        Seconds to wait between runs.
+    run_on_start : bool
+        Run right away when started instead of after the first interval.
+    """
+
+    def __init__(self, name: str, interval: float, run_on_start: bool = False) -> None:
+        self.name = name
+        self.interval = interval
+        self.run_on_start = run_on_start
+        self.pool: asyncpg.Pool | None = None
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+    async def run_once(self) -> None:
+        raise NotImplementedError
+
+    async def on_stop(self) -> None:
+        """Called once after the job has been stopped, e.g. to drain buffers."""
+
+    def start(self, pool: asyncpg.Pool) -> None:
+        self.pool = pool
+        self._wakeup = asyncio.Event()  # bind to the running loop
+        self._task = asyncio.create_task(self._run(), name=self.name)
+        if self.run_on_start:
+            self.wake()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self.pool is not None:
+            try:
+                await self.on_stop()
+            except Exception:
+                logger.exception(f"Background task '{self.name}' failed to stop.")
+
+    async def _run(self) -> None:
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            self._wakeup.clear()
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception(f"Background task '{self.name}' failed.")
+
+
+class ListeningTask(PeriodicTask):
+    """Background job that keeps state current through a notification channel.
+
+    Notifications are received on a dedicated connection outside of the pool.
+    Every run reconnects it if needed and then calls ``refresh`` to load the
+    full state, which also covers notifications missed while disconnected.
+    The job runs as soon as it is started.
+
+    Parameters
+    ----------
+    name : str
+        Name of the job used in logs.
+    interval : float
+        Seconds to wait between refreshes.
+    channel : str
+        Notification channel to listen on.
+    """
+
+    def __init__(self, name: str, interval: float, channel: str) -> None:
+        super().__init__(name, interval=interval, run_on_start=True)
+        self.channel = channel
+        self._listener: asyncpg.Connection | None = None
+
+    @property
+    def listening(self) -> bool:
+        return self._listener is not None and not self._listener.is_closed()
+
+    async def refresh(self) -> None:
+        raise NotImplementedError
+
+    def on_notification(self, payload: str) -> None:
+        raise NotImplementedError
+
+    def on_listener_lost(self) -> None:
+        """Called when notifications may have been missed, before reconnecting."""
+
+    async def run_once(self) -> None:
+        if not self.listening:
+            self.on_listener_lost()
+            self._listener = await asyncpg.connect(Connection.DATABASE_URL)
+            await self._listener.add_listener(self.channel, self._notified)
+            self._listener.add_termination_listener(self._lost)
+        await self.refresh()
+
+    def _notified(self, con, pid, channel, payload: str) -> None:
+        self.on_notification(payload)
+
+    def _lost(self, con) -> None:
+        logger.warning(
+            f"Background task '{self.name}' lost its notification connection."
+        )
+        self.on_listener_lost()
+        self.wake()
+
+    async def on_stop(self) -> None:
+        if self.listening:
+            self._listener.remove_termination_listener(self._lost)
+            await self._listener.close()
+        self._listener = None
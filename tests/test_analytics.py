@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+import ipaddress
+
+from lemonapi.utils.analytics import (
+    ClickLog,
+    ClickRollup,
+    classify_user_agent,
+    events_dropped,
+    ip_bucket,
+    rollup_clicks,
+)
+from lemonapi.utils.constants import Server
+
+
+def test_classify_user_agent():
+    assert classify_user_agent(None) == "unknown"
+    assert classify_user_agent("Googlebot/2.1") == "bot"
+    assert classify_user_agent("curl/8.0.1") == "bot"
+    assert classify_user_agent("Mozilla/5.0 (iPhone; CPU iPhone OS 17_0)") == "mobile"
+    assert classify_user_agent("Mozilla/5.0 (Windows NT 10.0; Win64; x64)") == "desktop"
+    assert classify_user_agent("Lemon/1.0") == "other"
+
+
+def test_ip_bucket():
+    assert ip_bucket("203.0.113.77") == ipaddress.ip_network("203.0.113.0/24")
+    assert ip_bucket("2001:db8:1234:5678::1") == ipaddress.ip_network(
+        "2001:db8:1234::/48"
+    )
+    assert ip_bucket("testclient") is None
+    assert ip_bucket(None) is None
+
+
+def counted(counter, labels: dict) -> int:
+    try:
+        return counter.get(labels)
+    except KeyError:  # not counted yet
+        return 0
+
+
+def dropped(reason: str) -> int:
+    return counted(events_dropped, {"reason": reason})
+
+
+def click_scope(user_agent: bytes = b"curl/8.0.1") -> dict:
+    return {"headers": [(b"user-agent", user_agent)], "client": ("203.0.113.77", 1)}
+
+
+def test_click_log_counts_overwritten_events(monkeypatch):
+    monkeypatch.setattr(Server, "CLICK_LOG_SIZE", 2)
+    click_log = ClickLog()
+    before = dropped("full")
+    for url_key in ("AAAAA", "BBBBB", "CCCCC"):
+        click_log.record(url_key, click_scope())
+
+    assert [click.url_key for click in click_log.events] == ["BBBBB", "CCCCC"]
+    assert dropped("full") == before + 1
+
+
+class FailingPool:
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    async def copy_records_to_table(self, table, records, columns) -> None:
+        raise ConnectionError("database is down")
+
+
+def test_click_log_drops_batch_when_write_fails():
+    click_log = ClickLog()
+    click_log.pool = FailingPool()
+    before = dropped("error")
+    click_log.record("AAAAA", click_scope())
+    click_log.record("BBBBB", click_scope())
+
+    asyncio.run(click_log.run_once())
+    assert not click_log.events
+    assert dropped("error") == before + 2
+
+
+class RollupConnection:
+    def __init__(self, last_click_id: int, upto: int, eligible: int) -> None:
+        self.click_ids = [last_click_id]
+        self.upto, self.eligible = upto, eligible
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def fetchval(self, query: str, *args):
+        if "pg_try_advisory_xact_lock" in query:
+            return True
+        if "FROM rollup_progress" in query:
+            return self.click_ids[-1]
+        assert args[:2] == (self.click_ids[-1], self.upto)
+        return self.eligible + 1  # one late event below upto
+
+    async def fetchrow(self, query: str, *args):
+        return self.upto if self.eligible else None, self.eligible
+
+    async def execute(self, query: str, *args) -> None:
+        assert "UPDATE rollup_progress" in query
+        self.click_ids.append(args[0])
+
+
+def test_click_rollup_advances_progress(monkeypatch):
+    monkeypatch.setattr(Server, "CLICK_ROLLUP_BATCH_SIZE", 2)
+    click_rollup = ClickRollup()
+    click_rollup.pool = RollupConnection(last_click_id=10, upto=13, eligible=2)
+    rolled_up = counted(rollup_clicks, {})
+
+    asyncio.run(click_rollup.run_once())
+    assert click_rollup.pool.click_ids == [10, 13]
+    assert rollup_clicks.get({}) == rolled_up + 3
+    assert click_rollup._wakeup.is_set()  # a full batch, more may be waiting
+
+    click_rollup._wakeup.clear()
+    click_rollup.pool = RollupConnection(last_click_id=13, upto=14, eligible=1)
+    asyncio.run(click_rollup.run_once())
+    assert click_rollup.pool.click_ids == [13, 14]
+    assert not click_rollup._wakeup.is_set()
+
+    click_rollup.pool = RollupConnection(last_click_id=14, upto=14, eligible=0)
+    asyncio.run(click_rollup.run_once())
+    assert click_rollup.pool.click_ids == [14]
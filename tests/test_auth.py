@@ -0,0 +1,203 @@
+import asyncio
+import contextlib
+import threading
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from jose import jwt
+
+from fastapi import HTTPException
+
+from lemonapi.utils.auth import (
+    PasswordHasher,
+    User,
+    api_key_cache,
+    decode_token,
+    expiration_time,
+    forget_session,
+    forget_user,
+    get_api_key_user,
+    get_session_user,
+    is_token_revoked,
+    token_cache,
+    user_from_claims,
+)
+from lemonapi.utils.constants import Server
+from lemonapi.utils.scope_registry import scope_registry
+from lemonapi.utils.revocation import revoked_tokens, session_salts
+
+
+def access_claims(**claims) -> dict:
+    expiration = datetime.utcnow() + timedelta(minutes=5)
+    return {
+        "id": "user",
+        "sid": "session",
+        "username": "lemon",
+        "grant_type": "access_token",
+        "expiration": expiration.timestamp(),
+        "salt": "salt",
+        "scopes": ["users:read"],
+        "disabled": False,
+        **claims,
+    }
+
+
+def test_user_from_claims_checks_salt(monkeypatch):
+    monkeypatch.setattr(session_salts, "salts", None)
+    assert user_from_claims(access_claims()) is None  # not loaded yet
+
+    monkeypatch.setattr(session_salts, "salts", {"session": "salt"})
+    user = user_from_claims(access_claims())
+    assert user.username == "lemon" and user.scopes == ["users:read"]
+
+    session_salts.update("session", "rotated")
+    with pytest.raises(HTTPException):
+        user_from_claims(access_claims())
+
+
+def test_user_from_claims_rejects_refresh_tokens(monkeypatch):
+    monkeypatch.setattr(session_salts, "salts", {"session": "salt"})
+    with pytest.raises(HTTPException):
+        user_from_claims(access_claims(grant_type="refresh_token"))
+    with pytest.raises(HTTPException):
+        user_from_claims(access_claims(expiration=0))
+
+
+def test_user_reads_is_banned_column():
+    user = User(username="lemon", user_id="user", is_banned=True)
+    assert user.is_disabled
+
+
+def test_password_hasher_rejects_when_queue_is_full():
+    hasher = PasswordHasher(workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def main():
+        running = [asyncio.ensure_future(hasher.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as error:
+            await hasher.run(release.wait)
+        assert error.value.status_code == 503
+        assert error.value.headers == {"Retry-After": "1"}
+        release.set()
+        assert await asyncio.gather(*running) == [True, True]
+        assert hasher.pending == 0
+
+    asyncio.run(main())
+    hasher.executor.shutdown()
+
+
+def test_password_hasher_counts_work_of_cancelled_callers():
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    release, finished = threading.Event(), threading.Event()
+
+    def work():
+        release.wait()
+        finished.set()
+
+    async def main():
+        caller = asyncio.ensure_future(hasher.run(work))
+        await asyncio.sleep(0)
+        caller.cancel()  # client went away, the thread keeps hashing
+        await asyncio.sleep(0)
+        assert hasher.pending == 1
+        with pytest.raises(HTTPException):
+            await hasher.run(work)
+        release.set()
+        await asyncio.to_thread(finished.wait)
+
+    asyncio.run(main())
+    hasher.executor.shutdown()
+    assert hasher.pending == 0
+
+
+class FakePool:
+    def __init__(self, row: dict) -> None:
+        self.row = row
+        self.queries = 0
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    async def fetchrow(self, query: str, *args) -> dict:
+        self.queries += 1
+        await asyncio.sleep(0)
+        return self.row
+
+
+def test_get_session_user_checks_salt():
+    row = {"user_id": "cached", "username": "lemon", "hashed_password": "x"}
+    pool = FakePool({**row, "salt": "salt"})
+
+    async def main():
+        users = await asyncio.gather(
+            *(get_session_user(pool, "cached", "cached", "salt") for _ in range(5))
+        )
+        assert all(user.username == "lemon" for user in users)
+        assert pool.queries == 2  # one for the session, one for the user
+
+        assert await get_session_user(pool, "cached", "cached", "old") is None
+        assert await get_session_user(pool, "cached", "other", "salt") is None
+        assert await get_session_user(pool, None, "cached", "salt") is None
+        pool.row = {**row, "salt": "rotated"}
+        assert await get_session_user(pool, "cached", "cached", "rotated")
+        assert await get_session_user(pool, "cached", "cached", "salt") is None
+
+    forget_session("cached")
+    forget_user("cached")
+    asyncio.run(main())
+    forget_session("cached")
+    forget_user("cached")
+
+
+def test_decode_token_caches_until_expiration():
+    token = jwt.encode(access_claims(), Server.SECRET_KEY, algorithm=Server.ALGORITHM)
+    expired = jwt.encode(
+        access_claims(expiration=0), Server.SECRET_KEY, algorithm=Server.ALGORITHM
+    )
+    size = len(token_cache)
+    assert decode_token(token) is decode_token(token)
+    assert decode_token(expired)["expiration"] == 0
+    assert len(token_cache) == size + 1
+
+
+def test_api_key_user_is_limited_to_user_scopes():
+    pool = FakePool(
+        {
+            "key_id": "key",
+            "user_id": "machine",
+            "username": "lemon",
+            "scopes": ["users:read", "admin"],
+            "user_scopes": ["users:read"],
+        }
+    )
+
+    async def main():
+        users = await asyncio.gather(
+            *(get_api_key_user(pool, "lemon_key") for _ in range(3))
+        )
+        assert pool.queries == 1
+        return users[0]
+
+    api_key_cache.clear()
+    user = asyncio.run(main())
+    api_key_cache.clear()
+    assert user.user_id == "machine"
+    assert user.scope_mask == scope_registry.mask(["users:read"])
+
+
+def test_revoked_tokens_are_checked_in_memory(monkeypatch):
+    claims = access_claims(jti="token")
+    expires_at = expiration_time(claims)
+    assert abs(expires_at - datetime.now(timezone.utc)) < timedelta(minutes=6)
+
+    monkeypatch.setattr(revoked_tokens, "tokens", {})
+    pool = FakePool({})
+    assert not asyncio.run(is_token_revoked(pool, claims))
+    revoked_tokens.add("token", expires_at)
+    assert asyncio.run(is_token_revoked(pool, claims))
+    assert not asyncio.run(is_token_revoked(pool, access_claims()))  # no jti
+    assert pool.queries == 0
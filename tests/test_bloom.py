@@ -0,0 +1,53 @@
+from lemonapi.utils.bloom import BloomFilter, UrlKeyFilter
+from lemonapi.utils.constants import Server
+from lemonapi.utils.keys import encode_key, permute
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [f"K{number:04}" for number in range(1000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"M{number:04}" in bloom for number in range(1000))
+    assert false_positives < 50
+
+
+class OpenConnection:
+    def is_closed(self) -> bool:
+        return False
+
+
+def test_url_key_filter_counts_local_keys_once():
+    url_filter = UrlKeyFilter()
+    url_filter.filter = BloomFilter(capacity=1000, error_rate=0.01)
+    url_filter._listener = OpenConnection()  # notifications will arrive
+
+    url_filter.add("AAAAA")
+    url_filter.on_notification("AAAAA")
+    url_filter.on_notification("BBBBB")  # created by another worker
+
+    assert url_filter.might_contain("AAAAA") and url_filter.might_contain("BBBBB")
+    assert url_filter.filter.count == 2
+
+
+def key(number: int) -> str:
+    return encode_key(permute(number))
+
+
+def test_url_key_filter_passes_keys_it_may_not_have_heard_of(monkeypatch):
+    monkeypatch.setattr(Server, "URL_FILTER_RECENT_IDS", 10)
+    url_filter = UrlKeyFilter()
+    url_filter.filter = BloomFilter(capacity=1000, error_rate=0.01)
+    url_filter.latest_id = 1000
+
+    assert url_filter.might_contain(key(1005))  # notification may be on its way
+    assert url_filter.might_contain(key(995))  # from a block reserved earlier
+    assert not url_filter.might_contain(key(500))
+    assert not url_filter.might_contain(key(5000))
+
+    url_filter.on_notification(key(1200))
+    assert url_filter.latest_id == 1200
+    assert url_filter.might_contain(key(1205))
+    assert not url_filter.might_contain(key(1005))
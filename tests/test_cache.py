@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from lemonapi.utils.cache import TTLCache
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TTLCache("test", maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_cache_expires_entries():
+    cache = TTLCache("test", maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+async def _load_once(cache: TTLCache, calls: list) -> str:
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return "value"
+
+    return await cache.get_or_load("key", loader)
+
+
+def test_cache_loads_concurrent_misses_once():
+    cache = TTLCache("test", maxsize=2, ttl=60)
+    calls = []
+
+    async def main():
+        return await asyncio.gather(*(_load_once(cache, calls) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert len(calls) == 1
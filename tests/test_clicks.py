@@ -0,0 +1,28 @@
+import asyncio
+import contextlib
+
+import pytest
+
+from lemonapi.utils.clicks import ClickCounter
+
+
+class FailingPool:
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    async def execute(self, query: str, *args) -> None:
+        raise ConnectionError("database is down")
+
+
+def test_failed_flush_keeps_clicks():
+    counter = ClickCounter()
+    counter.pool = FailingPool()
+    counter.record("AAAAA")
+    counter.record("AAAAA")
+    counter.record("BBBBB")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(counter.run_once())
+    counter.record("AAAAA")  # clicks recorded after the failure add up
+    assert counter.pending == {"AAAAA": 3, "BBBBB": 1}
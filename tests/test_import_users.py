@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import json
+
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from lemonapi.tools import import_users
+from lemonapi.tools.import_users import Checkpoint, read_chunks
+
+
+def test_read_chunks_keeps_remainder():
+    chunks = list(read_chunks(iter(range(5)), size=2))
+    assert chunks == [[0, 1], [2, 3], [4]]
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpoint = Checkpoint(tmp_path / "users.checkpoint")
+    assert checkpoint.load() == 0
+    checkpoint.save(1000)
+    assert checkpoint.load() == 1000
+    assert [path.name for path in tmp_path.iterdir()] == ["users.checkpoint"]
+
+
+class FakeConnection:
+    async def close(self) -> None:
+        pass
+
+
+def run_import(monkeypatch, path, loaded: list) -> None:
+    async def connect(dsn):
+        return FakeConnection()
+
+    async def load_chunk(con, records):
+        loaded.extend(record[1] for record in records)
+        # the last user already exists
+        return sum(record[1] != "user5" for record in records)
+
+    monkeypatch.setattr(import_users.asyncpg, "connect", connect)
+    monkeypatch.setattr(import_users, "load_chunk", load_chunk)
+    monkeypatch.setattr(import_users, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(import_users, "hash_password", lambda password: "hashed")
+    args = argparse.Namespace(
+        path=path,
+        format="ndjson",
+        dsn="",
+        chunk_size=2,
+        workers=1,
+        checkpoint=None,
+    )
+    asyncio.run(import_users.import_users(args))
+
+
+def test_import_skips_invalid_rows_and_resumes(monkeypatch, tmp_path):
+    rows = [
+        {"username": f"user{number}", "password": "secret", "full_name": "Lemon"}
+        for number in range(1, 6)
+    ]
+    for row in rows:
+        row["email"] = f"{row['username']}@localhost"
+    del rows[1]["email"]
+    path = tmp_path / "users.ndjson"
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    checkpoint = Checkpoint(path.with_suffix(".checkpoint"))
+    checkpoint.save(2)  # the first chunk was loaded before
+
+    loaded = []
+    run_import(monkeypatch, path, loaded)
+    assert loaded == ["user3", "user4", "user5"]
+    assert checkpoint.load() == 5
+
+    loaded.clear()
+    checkpoint.save(0)
+    messages = []
+    handler = logger.add(messages.append, level="WARNING")
+    try:
+        run_import(monkeypatch, path, loaded)
+    finally:
+        logger.remove(handler)
+    assert loaded == ["user1", "user3", "user4", "user5"]
+    assert len(messages) == 1 and "Skipped row 2 " in messages[0]
+    assert "secret" not in messages[0]
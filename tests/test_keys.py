@@ -0,0 +1,22 @@
+from lemonapi.utils.keys import decode_key, encode_key, key_id, permute, unpermute
+
+
+def test_encode_key_round_trip():
+    assert encode_key(0, length=5) == "AAAAA"
+    assert decode_key(encode_key(123_456, length=5)) == 123_456
+
+
+def test_permute_is_bijective():
+    keyspace = 36**2
+    assert sorted(permute(number, length=2) for number in range(keyspace)) == list(
+        range(keyspace)
+    )
+
+
+def test_unpermute_inverts_permute():
+    keyspace = 36**2
+    assert all(
+        unpermute(permute(number, length=2), length=2) == number
+        for number in range(keyspace)
+    )
+    assert key_id(encode_key(permute(123_456))) == 123_456
@@ -1,4 +1,12 @@
+import json
+
+from datetime import datetime, timedelta, timezone
+
+from lemonapi.endpoints.shortener import rejected_probes
 from lemonapi.main import app
+from lemonapi.utils.auth import User, get_current_user, password_hasher
+from lemonapi.utils.constants import Server
+from lemonapi.utils.crud import CrudService, ResolvedURL, url_cache
 
 from fastapi.testclient import TestClient
 
@@ -8,3 +16,134 @@ client = TestClient(app)
 def test_server_status():
     response = client.get("/status/")
     assert response.status_code == 200
+
+
+def test_redirect_short_url():
+    url_cache.set("TESTS", ResolvedURL("https://example.com/", True))
+    response = client.get("/TESTS", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://example.com/"
+
+
+def test_reject_impossible_url_key():
+    response = client.get("/wp-login.php")
+    assert response.status_code == 404
+
+
+def test_favicon_is_not_caught_as_url_key():
+    rejected = rejected_probes.get({})
+    response = client.get("/favicon.ico")
+    assert response.status_code == 200
+    assert rejected_probes.get({}) == rejected
+
+
+def test_expired_short_url_is_not_redirected():
+    expired = datetime.now(timezone.utc) - timedelta(seconds=1)
+    url_cache.set("EXPRD", ResolvedURL("https://example.com/", True, expired))
+    response = client.get("/EXPRD", follow_redirects=False)
+    assert response.status_code == 404
+
+
+def test_protected_route_requires_credentials():
+    response = client.get("/users/me")
+    assert response.status_code == 401
+
+
+def test_jwks_is_served():
+    response = client.get("/.well-known/jwks.json")
+    assert response.status_code == 200
+    assert response.json() == {"keys": []}  # tests sign with HS256
+
+
+def test_url_with_invalid_port_is_rejected():
+    response = client.post("/url/", json={"target_url": "http://a.com:99999/"})
+    assert response.status_code == 400
+
+
+def test_resolve_urls_streams_fetched_rows(monkeypatch):
+    class FakeCrudService:
+        async def get_db_urls_by_keys(self, url_keys):
+            assert url_keys == ["TESTS"]  # duplicates and impossible keys dropped
+            return [{"url_key": "TESTS", "target_url": "https://example.com/"}]
+
+    monkeypatch.setitem(app.dependency_overrides, CrudService, FakeCrudService)
+    monkeypatch.setattr(Server, "RESOLVE_URL_CHUNK_SIZE", 1)
+    urls = ["http://testserver/TESTS", "TESTS", "nope"]
+    response = client.post("/url/resolve", json=urls)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [
+        {"found": True, "url_key": "TESTS", "target_url": "https://example.com/"},
+        {"url_key": "nope", "found": False},
+    ]
+
+
+def test_api_keys_can_not_manage_credentials(monkeypatch):
+    user = User(username="lemon", user_id="user", scopes=["users:default"])
+    monkeypatch.setitem(app.dependency_overrides, get_current_user, lambda: user)
+    headers = {"X-API-Key": "lemon_key"}
+
+    responses = [
+        client.patch("/users/update/password?new_password=new", headers=headers),
+        client.post("/users/api-keys", json={"name": "more"}, headers=headers),
+        client.delete("/users/api-keys/other", headers=headers),
+    ]
+    assert [response.status_code for response in responses] == [403, 403, 403]
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+
+def test_disable_user_requires_scope(monkeypatch):
+    disabled = []
+
+    class FakeCrudService:
+        async def disable_user(self, user_id):
+            disabled.append(user_id)
+            return {"username": "lemon"}
+
+    admin = User(username="admin", user_id="admin", scopes=["admin"])
+    monkeypatch.setitem(app.dependency_overrides, CrudService, FakeCrudService)
+    monkeypatch.setitem(app.dependency_overrides, get_current_user, lambda: admin)
+    response = client.post("/users/user/disable")
+    assert response.status_code == 200
+    assert response.json() == {"detail": "User 'lemon' disabled"}
+    assert disabled == ["user"]
+
+    user = User(username="lemon", user_id="user", scopes=["users:default"])
+    monkeypatch.setitem(app.dependency_overrides, get_current_user, lambda: user)
+    assert client.post("/users/admin/disable").status_code == 401
+    assert disabled == ["user"]
+
+
+def test_url_stats(monkeypatch):
+    class FakeCrudService:
+        async def resolve_url(self, url_key):
+            if url_key == "TESTS":
+                return ResolvedURL("https://example.com/", True)
+
+        async def get_url_stats(self, url_key, minutes, hours, days):
+            assert (minutes, hours, days) == (5, 48, 30)
+            return {"clicks": 3, "minute": [], "hour": [], "day": []}
+
+    monkeypatch.setitem(app.dependency_overrides, CrudService, FakeCrudService)
+    response = client.get("/url/TESTS/stats?minutes=5")
+    assert response.json() == {
+        "url_key": "TESTS",
+        "clicks": 3,
+        "minute": [],
+        "hour": [],
+        "day": [],
+    }
+    assert client.get("/url/NOPES/stats").status_code == 404
+    assert client.get("/url/TESTS/stats?minutes=0").status_code == 422
+
+
+def test_busy_password_hasher_sends_retry_after(monkeypatch):
+    monkeypatch.setattr(password_hasher, "pending", password_hasher.max_pending)
+    user = {
+        "username": "lemon",
+        "password": "secret",
+        "email": "lemon@localhost",
+        "full_name": "Lemon",
+    }
+    response = client.post("/users/add/", params=user)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
@@ -0,0 +1,32 @@
+import pytest
+
+from fastapi import HTTPException
+
+from lemonapi.utils.auth import User
+from lemonapi.utils.scope_registry import ScopeRegistry
+from lemonapi.utils.scopes import RequiredScopes
+
+
+def test_registry_expands_hierarchy():
+    registry = ScopeRegistry(["admin"], {"admin": ["users:*"]})
+    read = registry.require(["users:read"])
+    write = registry.require(["users:write"])
+    registry.require(["lemons:read"])
+    assert registry.mask(["admin"]) == registry.bits["admin"] | read | write
+    assert registry.mask(["users:read", "unknown"]) == read
+
+
+def test_registry_fingerprint_changes_on_register():
+    registry = ScopeRegistry(["users:read"], {})
+    fingerprint = registry.fingerprint
+    registry.register("users:read")
+    assert registry.fingerprint == fingerprint
+    registry.register("users:write")
+    assert registry.fingerprint != fingerprint
+
+
+def test_required_scopes_checks_mask():
+    check = RequiredScopes(["users:read"])
+    assert check(User(username="admin", user_id="1", scopes=["admin"]))
+    with pytest.raises(HTTPException):
+        check(User(username="lemon", user_id="2", scopes=["lemons:read"]))
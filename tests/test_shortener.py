@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from lemonapi.endpoints.shortener import read_target_urls
+from lemonapi.utils.constants import Server
+
+
+def make_request(content_type: str, *chunks: bytes) -> Request:
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks
+    ]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0)
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "headers": [(b"content-type", content_type.encode())],
+    }
+    return Request(scope, receive)
+
+
+def read(content_type: str, *chunks: bytes) -> list[str]:
+    return asyncio.run(read_target_urls(make_request(content_type, *chunks)))
+
+
+def test_read_json_array():
+    body = b'["https://a.com/", {"target_url": "https://b.com/"}]'
+    assert read("application/json", body) == ["https://a.com/", "https://b.com/"]
+
+
+def test_read_json_rejects_other_bodies():
+    with pytest.raises(HTTPException) as error:
+        read("application/json", b'{"target_url": "https://a.com/"}')
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException) as error:
+        read("application/json", b'["https://a.com/", 1]')
+    assert error.value.status_code == 400
+
+
+def test_read_ndjson_lines_split_across_chunks():
+    chunks = (
+        b'"https://a.com/"\n{"target_u',
+        b'rl": "https://b.com/"}\n\n"https:',
+        b'//c.com/"',  # last line without a newline
+    )
+    assert read("application/x-ndjson", *chunks) == [
+        "https://a.com/",
+        "https://b.com/",
+        "https://c.com/",
+    ]
+
+
+def test_read_ndjson_rejects_invalid_json():
+    with pytest.raises(HTTPException) as error:
+        read("application/x-ndjson", b'"https://a.com/"\n{"target_url"\n')
+    assert error.value.status_code == 400
+
+
+def test_read_ndjson_over_limit(monkeypatch):
+    monkeypatch.setattr(Server, "BULK_URL_LIMIT", 2)
+    body = b'"https://a.com/"\n"https://b.com/"\n"https://c.com/"\n"https://d'
+    with pytest.raises(HTTPException) as error:
+        read("application/x-ndjson", body)
+    assert error.value.status_code == 413
+    with pytest.raises(HTTPException) as error:
+        read("application/json", b'["https://a.com/", "https://b.com/", "c"]')
+    assert error.value.status_code == 413
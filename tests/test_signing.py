@@ -0,0 +1,24 @@
+import ecdsa
+import pytest
+
+from jose import JWTError
+
+from lemonapi.utils.signing import KeyRing
+
+
+def new_key() -> str:
+    return ecdsa.SigningKey.generate(curve=ecdsa.NIST256p).to_pem().decode()
+
+
+def test_rotated_key_ring_verifies_old_tokens():
+    old, new = new_key(), new_key()
+    old_ring = KeyRing("ES256", "unused", [old])
+    rotated = KeyRing("ES256", "unused", [new, old])
+    token = old_ring.sign({"id": "user"})
+
+    assert rotated.verify(token) == {"id": "user"}
+    assert rotated.verify(rotated.sign({"id": "user"})) == {"id": "user"}
+    with pytest.raises(JWTError):
+        KeyRing("ES256", "unused", [new]).verify(token)
+    assert rotated.kid != old_ring.kid
+    assert old_ring.kid.encode() in rotated.jwks
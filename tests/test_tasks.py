@@ -0,0 +1,74 @@
+import asyncio
+
+from lemonapi.utils import tasks
+from lemonapi.utils.tasks import ListeningTask
+
+
+class FakeListener:
+    def __init__(self) -> None:
+        self.closed = False
+        self.listeners = {}
+        self.termination_listeners = []
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    async def add_listener(self, channel, callback) -> None:
+        self.listeners[channel] = callback
+
+    def add_termination_listener(self, callback) -> None:
+        self.termination_listeners.append(callback)
+
+    def remove_termination_listener(self, callback) -> None:
+        self.termination_listeners.remove(callback)
+
+    def terminate(self) -> None:
+        self.closed = True
+        for callback in self.termination_listeners:
+            callback(self)
+
+    async def close(self) -> None:
+        self.terminate()
+
+
+class Names(ListeningTask):
+    def __init__(self) -> None:
+        super().__init__("names", interval=60, channel="names")
+        self.names: set[str] | None = None
+        self.pool = object()  # marks the task as started
+
+    async def refresh(self) -> None:
+        self.names = {"loaded"}
+
+    def on_notification(self, payload: str) -> None:
+        self.names.add(payload)
+
+    def on_listener_lost(self) -> None:
+        self.names = None
+
+
+def test_listening_task_uses_own_connection(monkeypatch):
+    connections = []
+
+    async def connect(dsn):
+        connections.append(FakeListener())
+        return connections[-1]
+
+    monkeypatch.setattr(tasks.asyncpg, "connect", connect)
+    names = Names()
+
+    async def main():
+        await names.run_once()
+        connections[0].listeners["names"](connections[0], 1, "names", "new")
+        assert names.names == {"loaded", "new"}
+
+        connections[0].terminate()
+        assert names.names is None and names._wakeup.is_set()
+        await names.run_once()
+        assert len(connections) == 2 and names.names == {"loaded"}
+
+        await names.stop()
+        assert connections[1].closed
+        assert names.names == {"loaded"}  # closing on stop is not a loss
+
+    asyncio.run(main())